@@ -0,0 +1,22 @@
+import numpy as np
+
+
+CUBE_DIMENSIONS = ['Primary Type', 'Location Description', 'Hour', 'Month', 'Year']
+
+
+def crime_cube(data, dimensions=CUBE_DIMENSIONS):
+    dimensions = [d for d in dimensions if d in data.columns]
+    cube = data.groupby(dimensions, observed=True, sort=False).size()
+    cube = cube[cube > 0].rename('Count').reset_index()
+    for col in dimensions:
+        if cube[col].dtype.name == 'category':
+            cube[col] = cube[col].astype(str)
+    cube['Count'] = cube['Count'].astype(np.int32)
+    return cube
+
+
+def downsample_points(data, max_points=5000, seed=0):
+    if data.shape[0] <= max_points:
+        return data
+    rows = np.sort(np.random.RandomState(seed).choice(data.shape[0], max_points, replace=False))
+    return data.iloc[rows]
@@ -0,0 +1,269 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from crime_store import ingest_csv, read_partition, extra_columns, LOAD_COLUMNS
+from features import preprocess_data
+from sampling import nested_sample
+from evaluation import evaluate
+from knn_graph import KNN_CACHE
+from model_cache import MODEL_CACHE, clear_digests
+
+
+DEFAULT_SIZES = [2000, 10000, 50000, 100000]
+CRIME_TYPES = ['THEFT', 'BATTERY', 'CRIMINAL DAMAGE', 'NARCOTICS', 'ASSAULT', 'OTHER OFFENSE', 'BURGLARY',
+               'MOTOR VEHICLE THEFT', 'DECEPTIVE PRACTICE', 'ROBBERY', 'CRIMINAL TRESPASS', 'WEAPONS VIOLATION',
+               'PUBLIC PEACE VIOLATION', 'OFFENSE INVOLVING CHILDREN', 'PROSTITUTION', 'SEX OFFENSE', 'HOMICIDE']
+
+
+def zipf_choice(rng, values, n, a=1.3):
+    weights = 1.0 / np.arange(1, len(values) + 1) ** a
+    return np.asarray(values, dtype=object)[rng.choice(len(values), n, p=weights / weights.sum())]
+
+
+def synthetic_crimes(n, year=2020, seed=0):
+    rng = np.random.RandomState(seed)
+    start = pd.Timestamp('{:d}-01-01'.format(year)).value // 10 ** 9
+    seconds = start + rng.randint(0, 365 * 24 * 3600, n)
+    dates = pd.to_datetime(seconds, unit='s').strftime('%m/%d/%Y %I:%M:%S %p')
+    locations = ['LOCATION {:03d}'.format(i) for i in range(150)]
+    return pd.DataFrame({
+        'ID': np.arange(n) + 10000000,
+        'Case Number': ['JD{:06d}'.format(i) for i in range(n)],
+        'Date': dates,
+        'Block': ['{:03d}XX W STREET {:d}'.format(i % 1000, i % 400) for i in rng.randint(0, 40000, n)],
+        'IUCR': '0820',
+        'Primary Type': zipf_choice(rng, CRIME_TYPES, n),
+        'Description': 'SYNTHETIC',
+        'Location Description': zipf_choice(rng, locations, n),
+        'Arrest': rng.rand(n) < 0.15,
+        'Domestic': rng.rand(n) < 0.2,
+        'Community Area': rng.randint(1, 78, n).astype(float),
+        'Year': year,
+        'Updated On': dates,
+        'Latitude': 41.84 + rng.randn(n) * 0.08,
+        'Longitude': -87.68 + rng.randn(n) * 0.06,
+    })
+
+
+def synthetic_mnist(n, n_features=784, n_classes=10, seed=0):
+    rng = np.random.RandomState(seed)
+    centers = rng.randint(0, 256, (n_classes, n_features))
+    labels = rng.randint(0, n_classes, n)
+    feats = np.clip(centers[labels] + rng.randn(n, n_features) * 40, 0, 255).astype(np.float32)
+    return feats, labels.astype(str)
+
+
+class Workspace:
+    def __init__(self, seed=0):
+        self.seed = seed
+        self.root = tempfile.mkdtemp(prefix='crime-bench-')
+        self.frames = {}
+
+    def crimes(self, n):
+        if n not in self.frames:
+            self.frames[n] = synthetic_crimes(n, seed=self.seed)
+        return self.frames[n]
+
+    def csv(self, n):
+        path = os.path.join(self.root, 'crimes-{:d}.csv'.format(n))
+        if not os.path.exists(path):
+            self.crimes(n).to_csv(path, index=False)
+        return path
+
+    def close(self):
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+def setup_read_data(ws, n):
+    store = os.path.join(ws.root, 'store-{:d}'.format(n))
+    ingest_csv(ws.csv(n), root=store)
+    return store
+
+
+def run_read_data(store):
+    return read_partition(2020, columns=LOAD_COLUMNS, root=store)
+
+
+def run_ingest(path):
+    store = tempfile.mkdtemp(dir=os.path.dirname(path))
+    ingest_csv(path, root=store)
+    shutil.rmtree(store)
+
+
+def setup_loaded(ws, n):
+    return read_partition(2020, columns=LOAD_COLUMNS, root=setup_read_data(ws, n))
+
+
+def setup_extra(ws, n):
+    return extra_columns(setup_loaded(ws, n))[0]
+
+
+def setup_features(ws, n):
+    return preprocess_data(setup_extra(ws, n))[1]
+
+
+def setup_mnist(ws, n):
+    return synthetic_mnist(n, seed=ws.seed)[0]
+
+
+def embedding_stage(method, params):
+    def run(feats):
+        from dimension_reduction import fit_embedding
+        return fit_embedding(method, params, feats)
+    return run
+
+
+STAGES = {
+    'ingest_csv': (lambda ws, n: ws.csv(n), run_ingest),
+    'read_data': (setup_read_data, run_read_data),
+    'add_extra_columns': (setup_loaded, lambda data: extra_columns(data)),
+    'random_select': (setup_extra, lambda data: nested_sample(data, data.shape[0] // 2, seed=0)),
+    'random_select_stratified': (setup_extra, lambda data: nested_sample(data, data.shape[0] // 2, seed=0,
+                                                                         stratify_by='Primary Type')),
+    'preprocess_data': (setup_extra, preprocess_data),
+    'preprocess_data_sparse': (setup_extra, lambda data: preprocess_data(data, sparse=True)),
+    'pca': (setup_mnist, embedding_stage('pca', {})),
+    'kpca': (setup_mnist, embedding_stage('kpca', {'kernel': 'rbf'})),
+    'isomap': (setup_mnist, embedding_stage('isomap', {})),
+    'tsne': (setup_mnist, embedding_stage('tsne', {'perplexity': 30})),
+    'umap': (setup_mnist, embedding_stage('umap', {'n_neighbors': 15, 'min_dist': 0.1,
+                                                                         'metric': 'euclidean'})),
+    'crime_pca': (setup_features, embedding_stage('pca', {})),
+    'crime_umap': (setup_features, embedding_stage('umap', {'n_neighbors': 15, 'min_dist': 0.1,
+                                                             'metric': 'euclidean'})),
+}
+# Stages whose result is an embedding of setup_mnist data; --quality scores
+# them against the synthetic class labels.
+QUALITY_STAGES = {'pca', 'kpca', 'isomap', 'tsne', 'umap'}
+# Methods that build n x n matrices or optimise every point are capped so a
+# default run finishes; raise the caps with --max-rows.
+MAX_ROWS = {'isomap': 10000, 'tsne': 10000, 'umap': 50000, 'crime_umap': 50000}
+
+
+def reset_caches():
+    # Every run starts cold, so k-NN graphs, fitted models and array digests
+    # built by one repeat cannot speed up the next.
+    KNN_CACHE.clear()
+    MODEL_CACHE.clear()
+    clear_digests()
+
+
+def measure(fn, arg):
+    reset_caches()
+    start = time.perf_counter()
+    result = fn(arg)
+    return time.perf_counter() - start, result
+
+
+def measure_peak(fn, arg):
+    # Tracing slows allocation-heavy code down, so peak memory comes from a
+    # separate run that is not timed.
+    reset_caches()
+    tracemalloc.start()
+    try:
+        fn(arg)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(stages, sizes, repeat=3, max_rows=None, seed=0, quality=False, log=sys.stderr):
+    max_rows = dict(MAX_ROWS, **(max_rows or {}))
+    ws = Workspace(seed)
+    records = []
+    try:
+        for stage in stages:
+            setup, fn = STAGES[stage]
+            for n in sizes:
+                if n > max_rows.get(stage, n):
+                    continue
+                record = {'stage': stage, 'rows': n}
+                try:
+                    arg = setup(ws, n)
+                    runs = [measure(fn, arg) for _ in range(repeat)]
+                    peak = measure_peak(fn, arg)
+                except ImportError as e:
+                    record['skipped'] = str(e)
+                    records.append(record)
+                    print('{:<26s} {:>7d}  skipped: {}'.format(stage, n, e), file=log)
+                    break
+                times = [t for t, _ in runs]
+                record.update({'seconds_min': min(times),
+                               'seconds_median': float(np.median(times)),
+                               'peak_bytes': peak,
+                               'repeat': repeat})
+                if quality and stage in QUALITY_STAGES:
+                    record.update(evaluate(arg, runs[-1][1], synthetic_mnist(n, seed=seed)[1]))
+                del runs
+                records.append(record)
+                print('{:<26s} {:>7d}  {:9.4f}s  {:9.1f} MB'.format(
+                    stage, n, record['seconds_min'], record['peak_bytes'] / 2 ** 20), file=log)
+    finally:
+        ws.close()
+    return {'revision': git_revision(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'pandas': pd.__version__,
+            'results': records}
+
+
+def compare(baseline, current, out=sys.stdout):
+    old = {(r['stage'], r['rows']): r for r in baseline['results'] if 'seconds_min' in r}
+    print('{:<26s} {:>7s} {:>10s} {:>10s} {:>7s} {:>8s}'.format('stage', 'rows', 'old (s)', 'new (s)', 'time', 'memory'), file=out)
+    for r in current['results']:
+        b = old.get((r['stage'], r['rows']))
+        if b is None or 'seconds_min' not in r:
+            continue
+        print('{:<26s} {:>7d} {:10.4f} {:10.4f} {:6.2f}x {:7.2f}x'.format(
+            r['stage'], r['rows'], b['seconds_min'], r['seconds_min'],
+            r['seconds_min'] / max(b['seconds_min'], 1e-9), r['peak_bytes'] / max(b['peak_bytes'], 1)), file=out)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time the crime data and embedding pipelines on synthetic data.')
+    parser.add_argument('--stages', nargs='+', default=list(STAGES), choices=list(STAGES))
+    parser.add_argument('--sizes', nargs='+', type=int, default=DEFAULT_SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--max-rows', nargs='+', default=[], metavar='STAGE=ROWS',
+                        help='override the row caps of slow stages')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--quality', action='store_true',
+                        help='score embedding stages by trustworthiness, continuity and k-NN label accuracy')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+    args = parser.parse_args(argv)
+    max_rows = {k: int(v) for k, v in (item.split('=') for item in args.max_rows)}
+    results = run_benchmarks(args.stages, args.sizes, args.repeat, max_rows, args.seed, args.quality)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), results, out=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+import os
+import sys
+import glob
+import json
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from pandas.api.types import union_categoricals
+
+
+SUBSET_URL = 'https://raw.githubusercontent.com/CMU-IDS-2020/a3-05839-a3-fch-ljy/master/subset.csv'
+STORE_DIR = os.environ.get('CRIME_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'crime_store'))
+
+NAME_MAP = {"id":'ID',
+    "case_number":'Case Number',
+    "date":'Date',
+    "block":'Block',
+    "iucr":'IUCR',
+    "primary_type":'Primary Type',
+    "description":'Description',
+    "location_description":'Location Description',
+    "arrest":'Arrest',
+    "domestic":'Domestic',
+    "beat":'Beat',
+    "district":'District',
+    "ward":'Ward',
+    "community_area":'Community Area',
+    "fbi_code":'FBI Code',
+    "year":'Year',
+    "updated_on":'Updated On',
+    "x_coordinate":'X Coordinate',
+    "y_coordinate":'Y Coordinate',
+    "latitude":'Latitude',
+    "longitude":'Longitude',
+    "location":'Location'
+}
+
+STORE_COLUMNS = ['ID', 'Case Number', 'Date', 'Block', 'Primary Type', 'Description', 'Location Description',
+                 'Arrest', 'Domestic', 'Community Area', 'Year', 'Latitude', 'Longitude', 'Updated On']
+LOAD_COLUMNS = ['Date', 'Block', 'Primary Type', 'Description', 'Location Description', 'Arrest', 'Domestic',
+                'Community Area', 'Year', 'Latitude', 'Longitude', 'Case Number']
+CATEGORICAL_COLUMNS = ['Primary Type', 'Location Description', 'Block']
+EXTRA_COLUMNS = ['Date', 'Block', 'Primary Type', 'Description', 'Location Description', 'Arrest', 'Domestic',
+                 'Community Area', 'Year', 'Month', 'Latitude', 'Longitude', 'Case Number', 'Hour', 'Weekday',
+                 'Day of Year']
+
+
+# Dtypes of the frame the app works on once the calendar columns are added.
+FRAME_DTYPES = {'Block': 'category',
+                'Primary Type': 'category',
+                'Description': 'category',
+                'Location Description': 'category',
+                'Arrest': np.bool_,
+                'Domestic': np.bool_,
+                'Community Area': np.float32,
+                'Year': np.int16,
+                'Month': np.int8,
+                'Hour': np.int8,
+                'Weekday': np.int8,
+                'Day of Year': np.int16,
+                'Latitude': np.float32,
+                'Longitude': np.float32}
+
+
+DATE_FORMATS = ['%m/%d/%Y %I:%M:%S %p', '%Y-%m-%dT%H:%M:%S.000']
+
+
+def detect_date_format(dates, n_probe=100):
+    probe = dates.dropna().iloc[:n_probe]
+    best, best_hits = DATE_FORMATS[0], -1
+    for fmt in DATE_FORMATS:
+        hits = pd.to_datetime(probe, format=fmt, errors='coerce').notna().sum()
+        if hits > best_hits:
+            best, best_hits = fmt, hits
+    return best
+
+
+def parse_dates(dates):
+    fmt = detect_date_format(dates)
+    parsed = pd.to_datetime(dates, format=fmt, errors='coerce')
+    for other in DATE_FORMATS:
+        missing = parsed.isna() & dates.notna()
+        if not missing.any():
+            break
+        if other != fmt:
+            parsed[missing] = pd.to_datetime(dates[missing], format=other, errors='coerce')
+    failed = dates.index[parsed.isna()]
+    return parsed, failed
+
+
+def add_calendar_columns(data, parsed):
+    data['Month'] = parsed.dt.month.astype(FRAME_DTYPES['Month'])
+    data['Hour'] = parsed.dt.hour.astype(FRAME_DTYPES['Hour'])
+    data['Weekday'] = parsed.dt.weekday.astype(FRAME_DTYPES['Weekday'])
+    data['Day of Year'] = parsed.dt.dayofyear.astype(FRAME_DTYPES['Day of Year'])
+    return data
+
+
+def compact_frame(data):
+    for col, dtype in FRAME_DTYPES.items():
+        if col not in data.columns:
+            continue
+        if dtype == 'category':
+            values = data[col] if data[col].dtype.name == 'category' else data[col].astype('category')
+            # Categories inherited from a whole year partition are dropped so
+            # that hashing and grouping only see values that are present.
+            data[col] = values.cat.remove_unused_categories()
+        elif data[col].dtype != dtype:
+            if dtype == np.bool_ and data[col].dtype == object:
+                data[col] = data[col].astype(str).str.lower() == 'true'
+            else:
+                data[col] = data[col].astype(dtype)
+    return data
+
+
+def extra_columns(data):
+    parsed, failed = parse_dates(data.loc[:, 'Date'])
+    failed_dates = list(data.loc[failed, 'Date'])
+    keep = parsed.notna()
+    data = add_calendar_columns(data.loc[keep, [c for c in EXTRA_COLUMNS if c in data.columns]].copy(), parsed[keep])
+    return compact_frame(data.loc[:, EXTRA_COLUMNS]), failed_dates
+
+
+def partition_dir(year, root=STORE_DIR):
+    return os.path.join(root, 'year={:d}'.format(int(year)))
+
+
+def has_partition(year, root=STORE_DIR):
+    return len(glob.glob(os.path.join(partition_dir(year, root), '*.parquet'))) > 0
+
+
+def stored_years(root=STORE_DIR):
+    years = []
+    for path in glob.glob(os.path.join(root, 'year=*')):
+        if glob.glob(os.path.join(path, '*.parquet')):
+            years.append(int(os.path.basename(path).split('=')[1]))
+    return sorted(years)
+
+
+def normalize_frame(data):
+    data = data.rename(columns=NAME_MAP)
+    data = data.loc[:, [c for c in STORE_COLUMNS if c in data.columns]].copy()
+    for col in STORE_COLUMNS:
+        if col not in data.columns:
+            data[col] = np.nan
+    data = data.loc[:, STORE_COLUMNS]
+    data['ID'] = pd.to_numeric(data.loc[:, 'ID'], errors='coerce')
+    data = data[data.loc[:, 'ID'].notna()].copy()
+    data['ID'] = data.loc[:, 'ID'].astype(np.int64)
+    data['Year'] = pd.to_numeric(data.loc[:, 'Year'], errors='coerce').fillna(-1).astype(np.int64)
+    for col in ['Community Area', 'Latitude', 'Longitude']:
+        data[col] = pd.to_numeric(data.loc[:, col], errors='coerce')
+    for col in ['Arrest', 'Domestic']:
+        data[col] = data.loc[:, col].astype(str).str.lower() == 'true'
+    for col in ['Case Number', 'Date', 'Description', 'Updated On']:
+        data[col] = data.loc[:, col].astype(object).where(data.loc[:, col].notna(), None)
+    for col in CATEGORICAL_COLUMNS:
+        data[col] = data.loc[:, col].astype('category')
+    return data
+
+
+def write_partition(data, year, root=STORE_DIR, part=0):
+    path = partition_dir(year, root)
+    os.makedirs(path, exist_ok=True)
+    target = os.path.join(path, 'part-{:05d}.parquet'.format(part))
+    tmp = target + '.tmp'
+    data.reset_index(drop=True).to_parquet(tmp, index=False)
+    os.replace(tmp, target)
+    return target
+
+
+def replace_partition(data, year, root=STORE_DIR):
+    path = partition_dir(year, root)
+    old = glob.glob(os.path.join(path, '*.parquet'))
+    target = write_partition(data, year, root, part=0)
+    for f in old:
+        if f != target:
+            os.remove(f)
+    return target
+
+
+def read_partition(year, columns=LOAD_COLUMNS, root=STORE_DIR, retries=1):
+    parts = sorted(glob.glob(os.path.join(partition_dir(year, root), '*.parquet')))
+    if not parts:
+        raise FileNotFoundError('No stored partition for year {:d} in {}'.format(int(year), root))
+    try:
+        frames = [pd.read_parquet(p, columns=columns) for p in parts]
+    except FileNotFoundError:
+        # The partition was swapped by an ingest between listing and reading.
+        if retries <= 0:
+            raise
+        return read_partition(year, columns, root, retries - 1)
+    data = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+    for col in CATEGORICAL_COLUMNS:
+        if col in data.columns and data[col].dtype.name != 'category':
+            data[col] = data[col].astype('category')
+    return data
+
+
+def partition_rows(year, root=STORE_DIR):
+    # Row counts come from the Parquet footers, so sizing a multi-year
+    # selection does not read any column data.
+    parts = glob.glob(os.path.join(partition_dir(year, root), '*.parquet'))
+    return sum(pq.ParquetFile(p).metadata.num_rows for p in parts)
+
+
+def concat_frames(frames, columns=None):
+    frames = [f for f in frames if f is not None]
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    # pd.concat falls back to object columns when categories differ, so the
+    # categories are unified first to keep the result compact.
+    for col in frames[0].columns:
+        if all(f[col].dtype.name == 'category' for f in frames):
+            categories = union_categoricals([f[col] for f in frames], ignore_order=True).categories
+            frames = [f.assign(**{col: f[col].cat.set_categories(categories)}) for f in frames]
+    return pd.concat(frames, ignore_index=True)
+
+
+def read_years(years, columns=LOAD_COLUMNS, root=STORE_DIR, transform=None, max_workers=4):
+    # transform(year, frame) runs on each partition as soon as it is read,
+    # so only what it keeps has to fit in memory at once.
+    years = [y for y in years if has_partition(y, root)]
+
+    def load(year):
+        data = read_partition(year, columns=columns, root=root)
+        return transform(year, data) if transform is not None else data
+
+    if len(years) <= 1 or max_workers <= 1:
+        frames = [load(y) for y in years]
+    else:
+        with ThreadPoolExecutor(min(max_workers, len(years))) as pool:
+            frames = list(pool.map(load, years))
+    return concat_frames(frames, columns)
+
+
+def manifest_path(root=STORE_DIR):
+    return os.path.join(root, 'sources.json')
+
+
+def load_manifest(root=STORE_DIR):
+    try:
+        with open(manifest_path(root)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def source_years(source=SUBSET_URL, root=STORE_DIR):
+    # Years a source was found to contain when it was last ingested, or None
+    # if it has not been ingested into this store.
+    return load_manifest(root).get(source)
+
+
+def _record_source(source, years, root=STORE_DIR):
+    manifest = load_manifest(root)
+    manifest[source] = sorted(int(y) for y in years)
+    tmp = '{}.{:d}.tmp'.format(manifest_path(root), os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, manifest_path(root))
+
+
+def _swap_partition(staged, year, root=STORE_DIR):
+    target = partition_dir(year, root)
+    old = None
+    if os.path.exists(target):
+        old = tempfile.mkdtemp(prefix='.old-', dir=root)
+        os.rename(target, os.path.join(old, os.path.basename(target)))
+    os.rename(staged, target)
+    if old is not None:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+_ingest_lock = threading.Lock()
+
+
+def ingest_csv(source=SUBSET_URL, root=STORE_DIR, chunksize=200000):
+    # Partitions are written to a staging directory first and only renamed
+    # into place once the whole source has been read, so readers never see
+    # a half-written year.
+    os.makedirs(root, exist_ok=True)
+    with _ingest_lock:
+        staging = tempfile.mkdtemp(prefix='.ingest-', dir=root)
+        try:
+            written = {}
+            reader = pd.read_csv(source, chunksize=chunksize, usecols=lambda c: c in STORE_COLUMNS)
+            for chunk in reader:
+                chunk = normalize_frame(chunk)
+                for year, group in chunk.groupby('Year'):
+                    if year < 0:
+                        continue
+                    part = written.get(year, 0)
+                    write_partition(group, year, staging, part=part)
+                    written[year] = part + 1
+            for year in written:
+                _swap_partition(partition_dir(year, staging), year, root)
+            _record_source(source, written, root)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+    return sorted(written)
+
+
+if __name__ == '__main__':
+    source = sys.argv[1] if len(sys.argv) > 1 else SUBSET_URL
+    years = ingest_csv(source)
+    print('Stored years {} in {}'.format(years, STORE_DIR))
@@ -1,20 +1,104 @@
-import streamlit as st
-import openml
+import os
+import json
+import shutil
+import tempfile
+import functools
+import threading
+
+import numpy as np
 import pandas as pd
 
-@st.cache
+
+MNIST_DIR = os.environ.get('MNIST_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mnist_store'))
+
+
+class LazyFeatures:
+    # Zero-copy view over a uint8 memmap; rows become float32 only when
+    # they are indexed.
+    def __init__(self, base_array, dtype=np.float32):
+        self.base_array = base_array
+        self.dtype = np.dtype(dtype)
+        self.shape = base_array.shape
+        self.ndim = base_array.ndim
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, key):
+        return np.asarray(self.base_array[key], dtype=self.dtype)
+
+    def max(self, *args, **kwargs):
+        return float(self.base_array.max())
+
+
+def store_paths(name, root=MNIST_DIR):
+    base = os.path.join(root, name)
+    return base + '.u8', base + '.labels.npy', base + '.json'
+
+
+_store_lock = threading.Lock()
+
+
+def has_store(name, root=MNIST_DIR):
+    return all(os.path.exists(p) for p in store_paths(name, root))
+
+
+def write_store(name, chunks, n_rows, root=MNIST_DIR):
+    # The files are written to a staging directory and renamed into place
+    # with the metadata last, so has_store never sees a partial store.
+    os.makedirs(root, exist_ok=True)
+    staging = tempfile.mkdtemp(prefix='.write-', dir=root)
+    try:
+        feats_path, labels_path, meta_path = store_paths(name, staging)
+        feats, labels, columns, row = None, [], None, 0
+        for chunk in chunks:
+            if feats is None:
+                columns = [c for c in chunk.columns if c != 'class']
+                feats = np.memmap(feats_path, dtype=np.uint8, mode='w+', shape=(n_rows, len(columns)))
+            values = chunk.loc[:, columns].to_numpy()
+            feats[row:row + len(chunk)] = np.clip(values, 0, 255).astype(np.uint8)
+            labels.append(chunk['class'].astype(str).to_numpy())
+            row += len(chunk)
+        feats.flush()
+        del feats
+        np.save(labels_path, np.concatenate(labels).astype('U'))
+        with open(meta_path, 'w') as f:
+            json.dump({'shape': [row, len(columns)], 'columns': columns}, f)
+        for staged, target in zip(store_paths(name, staging), store_paths(name, root)):
+            os.replace(staged, target)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+
+def load_store(name, root=MNIST_DIR):
+    feats_path, labels_path, meta_path = store_paths(name, root)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    feats = np.memmap(feats_path, dtype=np.uint8, mode='r', shape=tuple(meta['shape']))
+    labels = np.load(labels_path)
+    return LazyFeatures(feats), labels, meta['columns']
+
+
+def count_rows(path):
+    with open(path) as f:
+        return sum(1 for _ in f) - 1
+
+
+@functools.lru_cache(maxsize=None)
 def mnist():
-    mnist = openml.datasets.get_dataset('mnist_784')
-    x, y, categorical, attribute_names = mnist.get_data()
-    feats = x[:2000].drop('class', axis='columns').to_numpy().astype('float32')
-    labels = x['class'].to_numpy()
-    raw = x
-    return feats, labels, raw
-
-@st.cache
-def mnist_csv():
-    x = pd.read_csv('mnist.csv')
-    feats = x.drop('class', axis='columns').to_numpy().astype('float32')
-    labels = x['class'].astype(str).to_numpy()
-    raw = x
-    return feats, labels, raw
\ No newline at end of file
+    with _store_lock:
+        if not has_store('mnist_openml'):
+            import openml
+            mnist = openml.datasets.get_dataset('mnist_784')
+            x, y, categorical, attribute_names = mnist.get_data()
+            write_store('mnist_openml', [x], len(x))
+            del x
+    return load_store('mnist_openml')
+
+
+@functools.lru_cache(maxsize=None)
+def mnist_csv(path='mnist.csv', chunksize=10000):
+    with _store_lock:
+        if not has_store('mnist_csv'):
+            write_store('mnist_csv', pd.read_csv(path, chunksize=chunksize), count_rows(path))
+    return load_store('mnist_csv')
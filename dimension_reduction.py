@@ -1,135 +1,318 @@
+import inspect
+
 import numpy as np
-import pandas as pd
-import streamlit as st
-import openml
-import plotly.express as px
-import plotly.graph_objects as go
-
-import keras
-from keras import layers
-from keras import activations
-from sklearn.decomposition import PCA, KernelPCA
-from sklearn.manifold import TSNE, Isomap
-from umap import UMAP
-from matplotlib import pyplot as plt
-from mpl_toolkits.mplot3d import Axes3D
 
+from evaluation import tracked
+from model_cache import MODEL_CACHE
+from knn_graph import APPROXIMATE_METRICS, KNN_CACHE, PrecomputedGraphModel, nndescent
 
-def pca(feats, indices):
-    model = PCA(n_components=3)
-    results = model.fit_transform(feats[indices, :])
-    
-    return results
 
+# Above EXACT_LIMIT rows PCA and KPCA switch to batched approximations
+# whose memory does not depend on the number of rows.
+EXACT_LIMIT = 5000
+BATCH_ROWS = 10000
+N_LANDMARKS = 500
 
-def kpca(feats, indices):
-    kernel = st.selectbox('Kernel', ['linear', 'poly', 'rbf', 'cosine'])
-    
-    model = KernelPCA(n_components=3, kernel=kernel)
-    results = model.fit_transform(feats[indices, :])
-    
-    return results
 
+def row_batches(n, batch_size=BATCH_ROWS):
+    for start in range(0, n, batch_size):
+        yield slice(start, min(start + batch_size, n))
 
-def isomap(feats, indices):
-    model = Isomap(n_components=3)
-    results = model.fit_transform(feats[indices, :])
-    
-    return results
-
-
-def tsne(feats, indices):
-    perplexity = st.slider('Perplexity',
-                           min_value=5,
-                           max_value=50,
-                           value=30,
-                           step=1)
-    
+
+class ScalablePCA:
+    # Large samples are reduced to their mean and d x d scatter matrix one
+    # batch at a time; the components are its leading eigenvectors, which is
+    # exact PCA without ever holding a centered copy of the data.
+    def __init__(self, n_components=3, exact_limit=EXACT_LIMIT, batch_size=BATCH_ROWS):
+        self.n_components = n_components
+        self.exact_limit = exact_limit
+        self.batch_size = batch_size
+
+    def _features(self, X):
+        return np.asarray(X)
+
+    def _fit_features(self, X):
+        pass
+
+    def fit(self, X):
+        from sklearn.decomposition import PCA
+        self._fit_features(X)
+        if X.shape[0] <= self.exact_limit:
+            self.model = PCA(n_components=self.n_components).fit(self._features(X))
+            return self
+        total, scatter = 0, 0
+        for rows in row_batches(X.shape[0], self.batch_size):
+            batch = self._features(X[rows]).astype(np.float64)
+            total = total + batch.sum(axis=0)
+            scatter = scatter + batch.T @ batch
+        mean = total / X.shape[0]
+        cov = (scatter - X.shape[0] * np.outer(mean, mean)) / max(X.shape[0] - 1, 1)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        components = eigvecs[:, ::-1][:, :self.n_components].T
+        # Same sign convention as sklearn: largest loading of each component
+        # is positive.
+        signs = np.sign(components[np.arange(len(components)), np.abs(components).argmax(axis=1)])
+        self.mean_ = mean
+        self.components_ = components * signs[:, None]
+        self.model = None
+        return self
+
+    def transform(self, X):
+        out = np.empty((X.shape[0], self.n_components), dtype=np.float32)
+        for rows in row_batches(X.shape[0], self.batch_size):
+            batch = self._features(X[rows])
+            if self.model is not None:
+                out[rows] = self.model.transform(batch)
+            else:
+                out[rows] = (batch - self.mean_) @ self.components_.T
+        return out
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+
+class ScalableKPCA(ScalablePCA):
+    # Large samples use a Nystroem feature map built on a random subset of
+    # landmark rows, followed by batched PCA in that feature space, instead
+    # of the n x n kernel matrix of KernelPCA.
+    def __init__(self, kernel='linear', n_components=3, n_landmarks=N_LANDMARKS,
+                 exact_limit=EXACT_LIMIT, batch_size=BATCH_ROWS):
+        super().__init__(n_components, exact_limit, batch_size)
+        self.kernel = kernel
+        self.n_landmarks = n_landmarks
+
+    def _features(self, X):
+        return self.feature_map.transform(np.asarray(X))
+
+    def _fit_features(self, X):
+        from sklearn.kernel_approximation import Nystroem
+        landmarks = np.random.RandomState(0).permutation(X.shape[0])[:self.n_landmarks]
+        self.feature_map = Nystroem(kernel=self.kernel, n_components=len(landmarks), random_state=0)
+        self.feature_map.fit(np.asarray(X[np.sort(landmarks)]))
+
+    def fit(self, X):
+        from sklearn.decomposition import KernelPCA
+        if X.shape[0] <= self.exact_limit:
+            self.model = KernelPCA(n_components=self.n_components, kernel=self.kernel).fit(X)
+            self.feature_map = None
+            return self
+        return super().fit(X)
+
+    def transform(self, X):
+        if self.feature_map is None:
+            return self.model.transform(X)
+        return super().transform(X)
+
+
+def pca_model():
+    return ScalablePCA(n_components=3)
+
+
+def kpca_model(kernel='linear'):
+    return ScalableKPCA(kernel=kernel, n_components=3)
+
+
+def isomap_model():
+    from sklearn.manifold import Isomap
+    return PrecomputedGraphModel(Isomap(n_components=3, n_neighbors=5, metric='precomputed'),
+                                 n_neighbors=5)
+
+
+def tsne_model(perplexity=30, init='random', warm_start=False):
+    from sklearn.manifold import TSNE
     model = TSNE(n_components=3, 
-                 n_iter=500,
+                 n_iter=300 if warm_start else 500,
                  n_iter_without_progress=100,
-                 early_exaggeration=20,
+                 early_exaggeration=1 if warm_start else 20,
                  perplexity=perplexity, 
                  method='barnes_hut',
-                 angle=1)
-    results = model.fit_transform(feats[indices, :])
-    
-    return results
-
-
-def umap(feats, indices):
-    metric = st.selectbox('Metric', [
-        'euclidean',
-        'manhattan',
-        'chebyshev',
-        'minkowski',
-        'canberra',
-        'braycurtis',
-        'mahalanobis',
-        'wminkowski',
-        'seuclidean',
-        'cosine',
-        'correlation'
-    ])
-    n_neighbors = st.slider('N Neighbors',
-                            min_value=2,
-                            max_value=200,
-                            value=15,
-                            step=1)
-    min_dist = st.slider('Minimum Distance',
-                            min_value=0.0,
-                            max_value=1.0,
-                            value=0.1,
-                            step=0.01)
-        
-    model = UMAP(n_components=3,
-                 n_neighbors=n_neighbors,
-                 min_dist=min_dist,
-                 metric=metric)
-    
-    results = model.fit_transform(feats[indices, :])
-    
-    return results
-    
-
-def ae(feats, indices):
-    hidden_size = st.slider('Hidden Size',
-                            min_value=3,
-                            max_value=feats.shape[1],
-                            value=int(np.sqrt(feats.shape[1])),
-                            step=1)
-    n_epochs = st.slider('Number of Epochs',
-                            min_value=1,
-                            max_value=20,
-                            value=5,
-                            step=1)
-    activation = st.selectbox('Activation', [
-        None,
-        'relu',
-        'sigmoid',
-        'tanh'
-    ], index=1)
-    
-    feat_max = np.max(feats)
-    
-    st.write(feats.shape)
-    
-    inputs = keras.Input(shape=(784,))
-    hidden1 = layers.Dense(hidden_size, activation=activation)(inputs)
-    hidden1_bn1 = layers.BatchNormalization()(hidden1)
-    encoded = layers.Dense(3)(hidden1_bn1)
-    encoded_bn = layers.BatchNormalization()(encoded)
-    hidden2 = layers.Dense(hidden_size, activation=activation)(encoded_bn)
-    hidden2_bn = layers.BatchNormalization()(hidden2)
-    decoded = layers.Dense(784, activation='sigmoid')(hidden2_bn)
-    autoencoder = keras.Model(inputs, decoded)
-    encoder = keras.Model(inputs, encoded_bn)
-    autoencoder.compile(optimizer='adam', loss='binary_crossentropy')
-    autoencoder.fit(feats / feat_max, feats/ feat_max,
-                    epochs=n_epochs,
-                    batch_size=256,
-                    shuffle=True)
-    
-    results = encoder.predict(feats[indices, :] / feat_max)
-   
-    return results
+                 angle=1,
+                 init=init,
+                 metric='precomputed')
+    return PrecomputedGraphModel(model, n_neighbors=int(3 * perplexity + 1), squared=True)
+
+
+class SharedKNNUMAP:
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    def fit_transform(self, X):
+        from umap import UMAP
+        n_neighbors, metric = self.kwargs['n_neighbors'], self.kwargs['metric']
+        # Without pynndescent, for a metric it does not support, or on a
+        # umap-learn older than 0.5.2 (no precomputed_knn), UMAP would get
+        # nothing from the shared graph, so none is built.
+        if (nndescent() is None or metric not in APPROXIMATE_METRICS or n_neighbors >= X.shape[0]
+                or 'precomputed_knn' not in inspect.signature(UMAP).parameters):
+            self.model = UMAP(**self.kwargs)
+            return self.model.fit_transform(X)
+        index = KNN_CACHE.get(X, n_neighbors, metric)
+        if index.search_index is not None:
+            knn_indices, knn_dists = index.knn(n_neighbors)
+            self.model = UMAP(precomputed_knn=(knn_indices, knn_dists, index.search_index), **self.kwargs)
+        else:
+            self.model = UMAP(**self.kwargs)
+        return self.model.fit_transform(X)
+
+    def transform(self, X):
+        return self.model.transform(X)
+
+
+def umap_model(n_neighbors=15, min_dist=0.1, metric='euclidean', init='spectral', warm_start=False):
+    return SharedKNNUMAP(n_components=3,
+                         n_neighbors=n_neighbors,
+                         min_dist=min_dist,
+                         metric=metric,
+                         init=init,
+                         n_epochs=100 if warm_start else None)
+
+
+def feature_batches(feats, batch_size, scale, seed=0):
+    # Endless stream of shuffled batches; rows inside a batch are sorted so
+    # reads from a memory-mapped store stay mostly sequential.
+    rng = np.random.RandomState(seed)
+    while True:
+        order = rng.permutation(len(feats))
+        for start in range(0, len(feats), batch_size):
+            x = feats[np.sort(order[start:start + batch_size])] / scale
+            yield x, x
+
+
+class AutoencoderEmbedding:
+    def __init__(self, hidden_size, n_epochs, activation, train_feats=None, batch_size=256):
+        self.train_feats = train_feats
+        self.hidden_size = hidden_size
+        self.n_epochs = n_epochs
+        self.activation = activation
+        self.batch_size = batch_size
+        self.encoder = None
+
+    def _build(self, n_features):
+        import keras
+        from keras import layers
+        inputs = keras.Input(shape=(n_features,))
+        hidden1 = layers.Dense(self.hidden_size, activation=self.activation)(inputs)
+        hidden1_bn1 = layers.BatchNormalization()(hidden1)
+        encoded = layers.Dense(3)(hidden1_bn1)
+        encoded_bn = layers.BatchNormalization()(encoded)
+        hidden2 = layers.Dense(self.hidden_size, activation=self.activation)(encoded_bn)
+        hidden2_bn = layers.BatchNormalization()(hidden2)
+        decoded = layers.Dense(n_features, activation='sigmoid')(hidden2_bn)
+        self.autoencoder = keras.Model(inputs, decoded)
+        self.encoder = keras.Model(inputs, encoded_bn)
+
+    def fit(self, X=None):
+        import tensorflow as tf
+        feats = self.train_feats if self.train_feats is not None else X
+        n_features = feats.shape[1]
+        self.scale = max(float(feats.max()), 1.0)
+        self._build(n_features)
+        self.autoencoder.compile(optimizer='adam', loss='binary_crossentropy')
+        dataset = tf.data.Dataset.from_generator(
+            lambda: feature_batches(feats, self.batch_size, self.scale),
+            output_types=(tf.float32, tf.float32),
+            output_shapes=((None, n_features), (None, n_features)))
+        self.autoencoder.fit(dataset.prefetch(2),
+                             epochs=self.n_epochs,
+                             steps_per_epoch=int(np.ceil(len(feats) / self.batch_size)),
+                             verbose=0)
+        return self
+
+    def transform(self, X):
+        return self.encoder.predict(np.asarray(X, dtype=np.float32) / self.scale,
+                                    batch_size=self.batch_size)
+
+    def fit_transform(self, X):
+        return self.fit(X).transform(X)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['train_feats'] = None
+        state.pop('autoencoder', None)
+        if self.encoder is not None:
+            state['encoder'] = (self.encoder.input_shape[1], self.autoencoder.get_weights())
+        return state
+
+    def __setstate__(self, state):
+        encoder = state.pop('encoder')
+        self.__dict__.update(state)
+        self.encoder = None
+        if encoder is not None:
+            n_features, weights = encoder
+            self._build(n_features)
+            self.autoencoder.set_weights(weights)
+
+
+def ae_model(hidden_size, n_epochs=5, activation='relu', train_feats=None):
+    return AutoencoderEmbedding(hidden_size, n_epochs, activation, train_feats=train_feats)
+
+
+MODELS = {'pca': pca_model,
+          'kpca': kpca_model,
+          'isomap': isomap_model,
+          'tsne': tsne_model,
+          'umap': umap_model,
+          'ae': ae_model}
+TRANSFORMABLE = {'pca', 'kpca', 'isomap', 'umap', 'ae'}
+# Methods whose model is trained on the whole feature store rather than on
+# the sampled rows only.
+TRAIN_ON_ALL = {'ae'}
+
+
+def fit_embedding(method, params, X):
+    return MODELS[method](**params).fit_transform(X)
+
+
+def fit_model(method, params, X, knn_indexes=None, trace_memory=False):
+    # Worker-side fit: returns the model so the parent can cache it for
+    # out-of-sample transforms, plus any k-NN graphs built on the way and
+    # the cost of the fit as measured inside the worker.
+    if knn_indexes:
+        KNN_CACHE.add(X, knn_indexes)
+    model = MODELS[method](**params)
+    with tracked(trace_memory) as cost:
+        coords = model.fit_transform(X)
+    return model, coords, KNN_CACHE.indexes_for(X), cost
+
+
+def transform_rows(model, X, trace_memory=False):
+    with tracked(trace_memory) as cost:
+        coords = model.transform(X)
+    return coords, cost
+
+
+def embed(method, feats, indices, params=None, cache=MODEL_CACHE):
+    params = dict(params or {})
+    model_params = dict(params, train_feats=feats) if method in TRAIN_ON_ALL else params
+    return cache.embed(method, feats, indices,
+                       lambda: MODELS[method](**model_params),
+                       params=params,
+                       transformable=method in TRANSFORMABLE)
+
+
+def pca(feats, indices):
+    return embed('pca', feats, indices)
+
+
+def kpca(feats, indices, kernel='linear'):
+    return embed('kpca', feats, indices, {'kernel': kernel})
+
+
+def isomap(feats, indices):
+    return embed('isomap', feats, indices)
+
+
+def tsne(feats, indices, perplexity=30):
+    return embed('tsne', feats, indices, {'perplexity': perplexity})
+
+
+def umap(feats, indices, n_neighbors=15, min_dist=0.1, metric='euclidean'):
+    return embed('umap', feats, indices, {'n_neighbors': n_neighbors,
+                                          'min_dist': min_dist,
+                                          'metric': metric})
+
+
+def ae(feats, indices, hidden_size=28, n_epochs=5, activation='relu'):
+    return embed('ae', feats, indices, {'hidden_size': hidden_size,
+                                        'n_epochs': n_epochs,
+                                        'activation': activation})
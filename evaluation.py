@@ -0,0 +1,121 @@
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+import numpy as np
+
+
+DEFAULT_K = 10
+DEFAULT_QUERIES = 500
+CHUNK_QUERIES = 64
+
+
+@contextmanager
+def tracked(trace_memory=True):
+    # Wall time of the block, and its peak traced memory when trace_memory
+    # is set, filled in on exit.
+    cost = {}
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    elif trace_memory and hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+    try:
+        yield cost
+    finally:
+        cost['fit_seconds'] = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1]
+        if started or (trace_memory and hasattr(tracemalloc, 'reset_peak')):
+            cost['peak_mb'] = max(peak - before, 0) / 2 ** 20
+        if started:
+            tracemalloc.stop()
+
+
+def tracked_steps(steps, cost, trace_memory=True):
+    # Drives a generator of fit steps, tracking only the time spent inside
+    # it, so whatever the caller does with each step is left out of cost.
+    steps = iter(steps)
+    cost['fit_seconds'] = 0.0
+    while True:
+        with tracked(trace_memory) as step:
+            item = next(steps, None)
+        cost['fit_seconds'] += step['fit_seconds']
+        if 'peak_mb' in step:
+            cost['peak_mb'] = max(cost.get('peak_mb', 0.0), step['peak_mb'])
+        if item is None:
+            return
+        yield item
+
+
+def sample_queries(n, n_queries=DEFAULT_QUERIES, seed=0):
+    if n <= n_queries:
+        return np.arange(n)
+    return np.sort(np.random.RandomState(seed).choice(n, n_queries, replace=False))
+
+
+def squared_distances(A, B, B_norms=None):
+    if B_norms is None:
+        B_norms = np.einsum('ij,ij->i', B, B)
+    d = np.einsum('ij,ij->i', A, A)[:, None] + B_norms[None, :] - 2 * (A @ B.T)
+    return np.maximum(d, 0)
+
+
+def _ranks(D, rows, cols):
+    # Rank (1 = nearest) of each (row, col) pair within its row of D. Equal
+    # distances are ordered by column index, as a stable argsort would, so
+    # duplicated rows are ranked the way sklearn's trustworthiness does.
+    target = D[rows[:, None], cols]
+    closer = D[:, None, :] < target[:, :, None]
+    tied = (D[:, None, :] == target[:, :, None]) & (np.arange(D.shape[1]) < cols[:, :, None])
+    return (closer | tied).sum(axis=2) + 1
+
+
+def _nearest(D, k):
+    return np.argsort(D, axis=1, kind='stable')[:, :k]
+
+
+def neighbourhood_scores(X, Y, k=DEFAULT_K, queries=None):
+    # Sampled trustworthiness and continuity (Venna & Kaski): penalties are
+    # averaged over the query points and rescaled to the full sample size.
+    X = np.asarray(X, dtype=np.float32)
+    Y = np.asarray(Y, dtype=np.float32)
+    n = X.shape[0]
+    k = min(k, n - 1)
+    if k < 1 or 2 * n - 3 * k - 1 <= 0:
+        return {'trustworthiness': np.nan, 'continuity': np.nan}, None
+    queries = np.arange(n) if queries is None else queries
+    x_norms, y_norms = np.einsum('ij,ij->i', X, X), np.einsum('ij,ij->i', Y, Y)
+    trust, cont, neighbours = 0.0, 0.0, []
+    for start in range(0, len(queries), CHUNK_QUERIES):
+        q = queries[start:start + CHUNK_QUERIES]
+        rows = np.arange(len(q))
+        DX = squared_distances(X[q], X, x_norms)
+        DY = squared_distances(Y[q], Y, y_norms)
+        DX[rows, q] = np.inf
+        DY[rows, q] = np.inf
+        NX, NY = _nearest(DX, k), _nearest(DY, k)
+        trust += np.maximum(_ranks(DX, rows, NY) - k, 0).sum()
+        cont += np.maximum(_ranks(DY, rows, NX) - k, 0).sum()
+        neighbours.append(NY)
+    scale = 2.0 / (len(queries) * k * (2 * n - 3 * k - 1))
+    return ({'trustworthiness': float(1 - scale * trust), 'continuity': float(1 - scale * cont)},
+            np.vstack(neighbours))
+
+
+def knn_accuracy(neighbours, labels, queries):
+    # Share of query points whose label wins the vote of their embedding
+    # neighbours.
+    codes = np.unique(labels, return_inverse=True)[1].ravel()
+    votes = np.zeros((len(queries), codes.max() + 1), dtype=np.int64)
+    np.add.at(votes, (np.repeat(np.arange(len(queries)), neighbours.shape[1]), codes[neighbours].ravel()), 1)
+    return float((votes.argmax(axis=1) == codes[queries]).mean())
+
+
+def evaluate(X, Y, labels=None, k=DEFAULT_K, n_queries=DEFAULT_QUERIES, seed=0):
+    queries = sample_queries(X.shape[0], n_queries, seed)
+    scores, neighbours = neighbourhood_scores(X, Y, k, queries)
+    if labels is not None and neighbours is not None:
+        scores['knn_accuracy'] = knn_accuracy(neighbours, np.asarray(labels), queries)
+    return scores
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+FIXED_VOCABULARIES = {'Month': list(range(1, 13)),
+                      'Hour': list(range(24))}
+
+
+class CategoryEncoder:
+    def __init__(self, vocabulary=None):
+        self.vocabulary = list(vocabulary) if vocabulary is not None else []
+
+    def fit(self, values):
+        values = pd.Series(values)
+        if values.dtype.name == 'category':
+            seen = list(values.cat.categories)
+        else:
+            seen = list(pd.unique(values.dropna()))
+        known = set(self.vocabulary)
+        self.vocabulary += sorted(v for v in seen if v not in known)
+        return self
+
+    def codes(self, values):
+        return pd.Categorical(values, categories=self.vocabulary).codes.astype(np.int64)
+
+    def transform(self, values, sparse=True, dtype=np.float32):
+        codes = self.codes(values)
+        n_rows, n_cols = len(codes), len(self.vocabulary)
+        valid = codes >= 0
+        if sparse:
+            indptr = np.concatenate([[0], np.cumsum(valid)])
+            return sp.csr_matrix((np.ones(valid.sum(), dtype=dtype), codes[valid], indptr),
+                                 shape=(n_rows, n_cols))
+        dense = np.zeros((n_rows, n_cols), dtype=dtype)
+        dense[np.nonzero(valid)[0], codes[valid]] = 1
+        return dense
+
+    def fit_transform(self, values, sparse=True, dtype=np.float32):
+        return self.fit(values).transform(values, sparse=sparse, dtype=dtype)
+
+    def feature_names(self, prefix):
+        return ['{}={}'.format(prefix, v) for v in self.vocabulary]
+
+
+def build_encoders(data, columns):
+    encoders = {}
+    for col in columns:
+        encoders[col] = CategoryEncoder(FIXED_VOCABULARIES.get(col))
+        if col not in FIXED_VOCABULARIES and col in data.columns:
+            encoders[col].fit(data.loc[:, col])
+    return encoders
+
+
+LABEL_COLUMN = 'Primary Type'
+# (column, kind) for every feature, in output order. 'one_hot' columns take
+# len(vocabulary) slots, 'flag' and 'standardize' columns one slot each.
+FEATURE_SPEC = [('Month', 'one_hot'),
+                ('Hour', 'one_hot'),
+                ('Location Description', 'one_hot'),
+                ('Arrest', 'flag'),
+                ('Domestic', 'flag'),
+                ('Community Area', 'one_hot'),
+                ('Latitude', 'standardize'),
+                ('Longitude', 'standardize')]
+REQUIRED_COLUMNS = ['Primary Type', 'Arrest', 'Domestic', 'Latitude', 'Longitude']
+CHUNK_ROWS = 20000
+ONE_HOT_COLUMNS = [col for col, kind in FEATURE_SPEC if kind == 'one_hot']
+
+
+def feature_layout(encoders, spec=FEATURE_SPEC):
+    offsets, width = [], 0
+    for col, kind in spec:
+        offsets.append(width)
+        width += len(encoders[col].vocabulary) if kind == 'one_hot' else 1
+    return offsets, width
+
+
+def column_stats(values):
+    values = values.astype(np.float64)
+    std = values.std()
+    return values.mean(), std if std > 0 else 1.0
+
+
+def preprocess_data(data, encoders=None, sparse=False, spec=FEATURE_SPEC, chunksize=CHUNK_ROWS):
+    # The output is allocated once and filled chunk by chunk, so besides the
+    # result only one chunk of encoded values is alive at a time.
+    if encoders is None:
+        encoders = build_encoders(data, [col for col, kind in spec if kind == 'one_hot'])
+    keep = data.loc[:, REQUIRED_COLUMNS].notna().all(axis=1).to_numpy()
+    rows = np.nonzero(keep)[0]
+    n_rows = len(rows)
+    offsets, width = feature_layout(encoders, spec)
+    stats = {col: column_stats(data[col].to_numpy()[rows]) for col, kind in spec if kind == 'standardize'}
+    if sparse:
+        # Every spec entry yields at most one non-zero per row, so the CSR
+        # arrays are filled through an (n_rows, len(spec)) slot table.
+        slot_cols = np.full((n_rows, len(spec)), -1, dtype=np.int32)
+        slot_vals = np.zeros((n_rows, len(spec)), dtype=np.float32)
+    else:
+        feats = np.zeros((n_rows, width), dtype=np.float32)
+    for start in range(0, n_rows, chunksize):
+        chunk = rows[start:start + chunksize]
+        at = np.arange(start, start + len(chunk))
+        for j, ((col, kind), offset) in enumerate(zip(spec, offsets)):
+            if kind == 'one_hot':
+                codes = encoders[col].codes(data[col].iloc[chunk])
+                valid = codes >= 0
+                cols, vals = offset + codes[valid], 1.0
+            else:
+                vals = data[col].to_numpy()[chunk].astype(np.float32)
+                if kind == 'standardize':
+                    mean, std = stats[col]
+                    vals = (vals - mean) / std
+                valid = vals != 0
+                cols, vals = offset, vals[valid]
+            if sparse:
+                slot_cols[at[valid], j] = cols
+                slot_vals[at[valid], j] = vals
+            else:
+                feats[at[valid], cols] = vals
+    if sparse:
+        filled = slot_cols >= 0
+        indptr = np.concatenate([[0], np.cumsum(filled.sum(axis=1))])
+        feats = sp.csr_matrix((slot_vals[filled], slot_cols[filled], indptr), shape=(n_rows, width))
+    labels = data[LABEL_COLUMN].iloc[rows].reset_index(drop=True)
+    return labels, feats
@@ -0,0 +1,49 @@
+import numpy as np
+import pandas as pd
+
+
+FILTER_COLUMNS = ['Primary Type', 'Location Description', 'Month', 'Hour', 'Year']
+OTHER = 'OTHER'
+
+
+class FilterIndex:
+    def __init__(self, data, columns=FILTER_COLUMNS):
+        self.n_rows = data.shape[0]
+        self.codes = {}
+        self.categories = {}
+        self.counts = {}
+        for col in columns:
+            values = data.loc[:, col]
+            if values.dtype.name == 'category':
+                codes, categories = values.cat.codes.to_numpy(), values.cat.categories
+            else:
+                codes, categories = pd.factorize(values, sort=True)
+            self.codes[col] = codes.astype(np.int32)
+            self.categories[col] = pd.Index(categories)
+            self.counts[col] = np.bincount(self.codes[col][self.codes[col] >= 0], minlength=len(categories))
+
+    def value_counts(self, col):
+        return pd.Series(self.counts[col], index=self.categories[col]).sort_values(ascending=False, kind='mergesort')
+
+    def top(self, col, n):
+        counts = self.value_counts(col)
+        return list(counts[counts > 0].index[:n])
+
+    def isin(self, col, values):
+        # One extra slot at the end of the lookup table catches missing
+        # values, whose code is -1.
+        lookup = np.zeros(len(self.categories[col]) + 1, dtype=bool)
+        positions = self.categories[col].get_indexer(list(values))
+        lookup[positions[positions >= 0]] = True
+        return lookup[self.codes[col]]
+
+    def select(self, col, selected, listed):
+        if not selected:
+            return np.ones(self.n_rows, dtype=bool)
+        if OTHER not in selected:
+            return self.isin(col, selected)
+        unselected = [v for v in listed if v != OTHER and v not in selected]
+        return ~self.isin(col, unselected)
+
+    def equals(self, col, value):
+        return self.isin(col, [value])
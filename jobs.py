@@ -0,0 +1,192 @@
+import os
+import atexit
+import threading
+import traceback
+import multiprocessing
+from collections import OrderedDict
+
+
+PENDING, RUNNING, DONE, FAILED, CANCELLED = 'pending', 'running', 'done', 'failed', 'cancelled'
+
+
+def _serve(conn):
+    # Worker loop: the process stays alive between jobs, so the imports and
+    # numba compilation done by one fit are reused by the next.
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        fn, args, kwargs = task
+        try:
+            conn.send((DONE, fn(*args, **kwargs)))
+        except BaseException:
+            conn.send((FAILED, traceback.format_exc()))
+
+
+class Worker:
+    def __init__(self, context):
+        self.conn, child = context.Pipe()
+        self.process = context.Process(target=_serve, args=(child,), daemon=True)
+        self.process.start()
+        child.close()
+        self.job = None
+
+    def stop(self):
+        if self.job is None and self.process.is_alive():
+            try:
+                self.conn.send(None)
+            except OSError:
+                pass
+            self.process.join(1)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self.conn.close()
+
+
+class Job:
+    def __init__(self, key, fn, args, kwargs):
+        self.key = key
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.worker = None
+        self.slots = set()
+
+    @property
+    def finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+
+class JobScheduler:
+    def __init__(self, max_workers=None, max_results=4, start_method=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_results = max_results
+        self.context = multiprocessing.get_context(start_method)
+        self.jobs = OrderedDict()
+        self.workers = []
+        self.slots = {}
+        self.lock = threading.RLock()
+
+    def submit(self, slot, key, fn, *args, **kwargs):
+        with self.lock:
+            previous = self.slots.get(slot)
+            if previous is not None and previous.key != key:
+                self._release(previous, slot)
+            job = self.jobs.get(key)
+            if job is None or job.state in (FAILED, CANCELLED):
+                job = Job(key, fn, args, kwargs)
+                self.jobs[key] = job
+            self.jobs.move_to_end(key)
+            job.slots.add(slot)
+            self.slots[slot] = job
+            self._pump()
+            return job
+
+    def _release(self, job, slot):
+        job.slots.discard(slot)
+        if not job.slots and not job.finished:
+            self._cancel(job)
+
+    def _cancel(self, job):
+        # A worker cannot be interrupted mid-fit, so it is replaced.
+        if job.worker is not None:
+            self.workers.remove(job.worker)
+            job.worker.job = None
+            job.worker.process.terminate()
+            job.worker.stop()
+            job.worker = None
+        job.state = CANCELLED
+        job.args = job.kwargs = None
+        self.jobs.pop(job.key, None)
+
+    def cancel(self, slot):
+        with self.lock:
+            job = self.slots.pop(slot, None)
+            if job is not None:
+                self._release(job, slot)
+
+    def _collect(self, worker):
+        job = worker.job
+        try:
+            if not worker.conn.poll():
+                if worker.process.is_alive():
+                    return
+                raise EOFError
+            job.state, payload = worker.conn.recv()
+        except (EOFError, OSError):
+            job.state, payload = FAILED, 'worker exited with code {}'.format(worker.process.exitcode)
+            self.workers.remove(worker)
+            worker.job = None
+            worker.stop()
+        if job.state == DONE:
+            job.result = payload
+        else:
+            job.error = payload
+        worker.job = job.worker = None
+        job.args = job.kwargs = None
+
+    def _pump(self):
+        for worker in list(self.workers):
+            if worker.job is not None:
+                self._collect(worker)
+        idle = [worker for worker in self.workers if worker.job is None]
+        for job in list(self.jobs.values()):
+            if job.state != PENDING:
+                continue
+            if idle:
+                worker = idle.pop()
+            elif len(self.workers) < self.max_workers:
+                worker = Worker(self.context)
+                self.workers.append(worker)
+            else:
+                break
+            worker.conn.send((job.fn, job.args, job.kwargs))
+            worker.job, job.worker, job.state = job, worker, RUNNING
+        finished = [key for key, job in self.jobs.items() if job.finished]
+        for key in finished[:max(0, len(finished) - self.max_results)]:
+            del self.jobs[key]
+
+    def take(self, job, slot):
+        # Hands the result to the slot that waited for it. Once no slot is
+        # left the job is dropped, so finished results are not kept here on
+        # top of the caches the caller stores them in.
+        with self.lock:
+            result = job.result
+            job.slots.discard(slot)
+            if self.slots.get(slot) is job:
+                del self.slots[slot]
+            if not job.slots:
+                job.result = None
+                if self.jobs.get(job.key) is job:
+                    del self.jobs[job.key]
+            return result
+
+    def poll(self, job):
+        with self.lock:
+            self._pump()
+            return job.state
+
+    def shutdown(self):
+        with self.lock:
+            for job in list(self.jobs.values()):
+                if not job.finished:
+                    self._cancel(job)
+            self.slots.clear()
+            for worker in self.workers:
+                worker.stop()
+            self.workers = []
+
+
+# Workers are spawned rather than forked: the server process runs numba and
+# BLAS threads and holds cache locks, which a forked child would inherit in
+# whatever state they happened to be.
+JOBS = JobScheduler(max_workers=int(os.environ.get('EMBEDDING_WORKERS', 0)) or None,
+                    start_method=os.environ.get('EMBEDDING_START_METHOD', 'spawn'))
+atexit.register(JOBS.shutdown)
@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.neighbors import NearestNeighbors
+
+from model_cache import array_digest
+
+
+_nndescent = []
+
+
+def nndescent():
+    # pynndescent compiles with numba on import, so it is only loaded when
+    # the first index is built.
+    if not _nndescent:
+        try:
+            from pynndescent import NNDescent
+        except ImportError:
+            NNDescent = None
+        _nndescent.append(NNDescent)
+    return _nndescent[0]
+
+
+MIN_NEIGHBORS = 32
+APPROXIMATE_METRICS = {'euclidean', 'manhattan', 'chebyshev', 'minkowski', 'canberra',
+                       'braycurtis', 'cosine', 'correlation'}
+
+
+class KNNIndex:
+    def __init__(self, data, n_neighbors, metric='euclidean'):
+        self.n_fit = data.shape[0]
+        self.n_neighbors = min(n_neighbors, self.n_fit)
+        self.metric = metric
+        NNDescent = nndescent()
+        if NNDescent is not None and metric in APPROXIMATE_METRICS:
+            self.index = NNDescent(data, metric=metric, n_neighbors=self.n_neighbors, random_state=0)
+            self.indices, self.dists = self.index.neighbor_graph
+        else:
+            self.index = NearestNeighbors(n_neighbors=self.n_neighbors, metric=metric).fit(data)
+            self.dists, self.indices = self.index.kneighbors(data)
+
+    @property
+    def search_index(self):
+        return None if isinstance(self.index, NearestNeighbors) else self.index
+
+    def knn(self, k):
+        return self.indices[:, :k], self.dists[:, :k]
+
+    def query(self, X, k):
+        k = min(k, self.n_fit)
+        if isinstance(self.index, NearestNeighbors):
+            dists, indices = self.index.kneighbors(X, n_neighbors=k)
+        else:
+            indices, dists = self.index.query(X, k=k)
+        return indices, dists
+
+    def graph(self, k, X=None, squared=False):
+        # Sparse distance graph in the layout of KNeighborsTransformer: each
+        # training sample keeps itself as an explicit zero entry.
+        if X is None:
+            indices, dists = self.knn(k)
+        else:
+            indices, dists = self.query(X, k)
+        dists = dists.astype(np.float64) ** 2 if squared else dists.astype(np.float64)
+        n_rows = indices.shape[0]
+        indptr = np.arange(0, n_rows * indices.shape[1] + 1, indices.shape[1])
+        return sp.csr_matrix((dists.ravel(), indices.ravel(), indptr), shape=(n_rows, self.n_fit))
+
+
+class KNNCache:
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, data, n_neighbors, metric='euclidean'):
+        key = (array_digest(data), metric)
+        with self.lock:
+            index = self.entries.get(key)
+            if index is not None:
+                self.entries.move_to_end(key)
+        if index is None or index.n_neighbors < min(n_neighbors, data.shape[0]):
+            index = KNNIndex(data, max(n_neighbors, MIN_NEIGHBORS), metric)
+            with self.lock:
+                self.entries[key] = index
+                self.entries.move_to_end(key)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return index
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def indexes_for(self, data):
+        # Every index built on data, keyed by metric, so a worker process can
+        # start from the graphs the parent already has and vice versa.
+        digest = array_digest(data)
+        with self.lock:
+            return {metric: index for (d, metric), index in self.entries.items() if d == digest}
+
+    def add(self, data, indexes):
+        digest = array_digest(data)
+        with self.lock:
+            for metric, index in indexes.items():
+                current = self.entries.get((digest, metric))
+                if current is None or current.n_neighbors < index.n_neighbors:
+                    self.entries[(digest, metric)] = index
+                self.entries.move_to_end((digest, metric))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+KNN_CACHE = KNNCache()
+
+
+class PrecomputedGraphModel:
+    def __init__(self, model, n_neighbors, metric='euclidean', squared=False, include_self=True):
+        self.model = model
+        self.n_neighbors = n_neighbors
+        self.metric = metric
+        self.squared = squared
+        self.include_self = include_self
+
+    def fit_transform(self, X):
+        k = min(self.n_neighbors + int(self.include_self), X.shape[0])
+        self.index = KNN_CACHE.get(X, k, self.metric)
+        return self.model.fit_transform(self.index.graph(k, squared=self.squared))
+
+    def transform(self, X):
+        k = min(self.n_neighbors + int(self.include_self), self.index.n_fit)
+        return self.model.transform(self.index.graph(k, X, squared=self.squared))
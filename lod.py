@@ -0,0 +1,71 @@
+import numpy as np
+
+
+MAX_DISPLAY_POINTS = 5000
+QUANTIZATION_LEVELS = 4096
+
+
+def normalize(coords):
+    low, high = coords.min(axis=0), coords.max(axis=0)
+    return (coords - low) / np.where(high > low, high - low, 1), low, high
+
+
+def _cells(unit, codes, n_codes, resolution):
+    cells = np.minimum((unit * resolution).astype(np.int64), resolution - 1)
+    keys = ((cells[:, 0] * resolution + cells[:, 1]) * resolution + cells[:, 2]) * n_codes + codes
+    return np.unique(keys, return_index=True, return_inverse=True)[1:]
+
+
+def voxel_downsample(coords, labels, max_points=MAX_DISPLAY_POINTS):
+    # Keeps one representative per (voxel, label) on the finest grid that
+    # stays within max_points, so dense clusters collapse while sparse
+    # regions and outliers survive. Returns the representatives' row
+    # numbers and how many points each one stands for.
+    n = coords.shape[0]
+    if n <= max_points:
+        return np.arange(n), np.ones(n, dtype=np.int64)
+    unit = normalize(coords)[0]
+    names, codes = np.unique(labels, return_inverse=True)
+    codes = codes.ravel()
+    low, high = 1, int(np.ceil(max_points ** (1 / 3.0))) + 1
+    while len(_cells(unit, codes, len(names), high)[0]) <= max_points and high < 2 ** 12:
+        low, high = high, high * 2
+    while high - low > 1:
+        mid = (low + high) // 2
+        if len(_cells(unit, codes, len(names), mid)[0]) <= max_points:
+            low = mid
+        else:
+            high = mid
+    first, inverse = _cells(unit, codes, len(names), low)
+    return first, np.bincount(inverse.ravel(), minlength=len(first))
+
+
+def region_mask(coords, box):
+    # box holds (low, high) fractions of the embedding's range per axis.
+    unit = normalize(coords)[0]
+    mask = np.ones(coords.shape[0], dtype=bool)
+    for axis, (low, high) in enumerate(box):
+        mask &= (unit[:, axis] >= low) & (unit[:, axis] <= high)
+    return mask
+
+
+def quantize(coords, levels=QUANTIZATION_LEVELS):
+    # Plotly serializes figures as JSON text, where a float32 widened to
+    # float64 prints with ~17 digits. Rounding to about 1/levels of the
+    # plotted range in decimal digits keeps each value a few bytes long.
+    if coords.shape[0] == 0:
+        return coords.astype(np.float64)
+    span = float((coords.max(axis=0) - coords.min(axis=0)).max())
+    decimals = max(0, int(np.ceil(-np.log10(span / levels)))) if span > 0 else 0
+    return np.round(coords.astype(np.float64), decimals)
+
+
+def display_points(coords, labels, box=None, max_points=MAX_DISPLAY_POINTS):
+    coords = np.asarray(coords, dtype=np.float32)
+    labels = np.asarray(labels)
+    rows = np.arange(coords.shape[0])
+    if box is not None:
+        rows = rows[region_mask(coords, box)]
+    keep, counts = voxel_downsample(coords[rows], labels[rows], max_points)
+    rows = rows[keep]
+    return quantize(coords[rows]), labels[rows], counts
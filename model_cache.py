@@ -0,0 +1,153 @@
+import os
+import json
+import pickle
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import scipy.sparse as sp
+
+from result_store import RESULT_STORE
+
+
+_digests = {}
+
+
+def array_digest(arr):
+    # Feature matrices are treated as immutable, so the digest of an array
+    # object is remembered until that object is collected. Lazy views
+    # are hashed through the array they wrap.
+    arr = getattr(arr, 'base_array', arr)
+    memo = _digests.get(id(arr))
+    if memo is not None and memo[0]() is arr:
+        return memo[1]
+    h = hashlib.sha1()
+    if sp.issparse(arr):
+        csr = arr.tocsr()
+        h.update(str((csr.shape, csr.dtype.str)).encode())
+        for part in (csr.data, csr.indices, csr.indptr):
+            h.update(np.ascontiguousarray(part).data)
+    else:
+        a = np.ascontiguousarray(arr)
+        h.update(str((a.shape, a.dtype.str)).encode())
+        h.update(a.data)
+    digest = h.hexdigest()
+    key = id(arr)
+
+    def forget(ref):
+        # id() values are reused, so only drop the entry if it is still ours.
+        if _digests.get(key, (None,))[0] is ref:
+            _digests.pop(key, None)
+    try:
+        _digests[key] = (weakref.ref(arr, forget), digest)
+    except TypeError:
+        pass
+    return digest
+
+
+def clear_digests():
+    _digests.clear()
+
+
+def params_digest(method, params):
+    return hashlib.sha1(json.dumps([method, params], sort_keys=True, default=str).encode()).hexdigest()
+
+
+class CacheEntry:
+    def __init__(self, n_rows, n_components):
+        self.model = None
+        self.embedded = np.full((n_rows, n_components), np.nan, dtype=np.float32)
+
+
+class ModelCache:
+    def __init__(self, max_entries=8, cache_dir=None, shared=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.shared = shared
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pkl')
+
+    def _get(self, key):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+        if self.cache_dir and os.path.exists(self._path(key)):
+            try:
+                with open(self._path(key), 'rb') as f:
+                    entry = pickle.load(f)
+            except Exception:
+                return None
+            self._put(key, entry, persist=False)
+            return entry
+        if self.shared is not None:
+            entry = self.shared.get(key)
+            if entry is not None:
+                self._put(key, entry, persist=False)
+                return entry
+        return None
+
+    def _put(self, key, entry, persist=True):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        if persist and self.cache_dir:
+            tmp = self._path(key) + '.tmp'
+            try:
+                with open(tmp, 'wb') as f:
+                    pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp, self._path(key))
+            except Exception:
+                if os.path.exists(tmp):
+                    os.remove(tmp)
+        if persist and self.shared is not None:
+            self.shared.put(key, entry)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def lookup(self, method, feats, indices, params=None, transformable=True, n_components=3):
+        # Returns the cache key, the (possibly new) entry and the rows of
+        # indices that still have to be embedded.
+        indices = np.asarray(indices, dtype=np.int64)
+        key = params_digest(method, params or {}) + '-' + array_digest(feats)
+        if not transformable:
+            key += '-' + hashlib.sha1(indices.tobytes()).hexdigest()
+        entry = self._get(key)
+        if entry is None:
+            entry = CacheEntry(feats.shape[0], n_components)
+        return key, entry, indices[np.isnan(entry.embedded[indices, 0])]
+
+    def update(self, key, entry, rows, coords, model=None, transformable=True):
+        if model is not None:
+            entry.model = model
+        entry.embedded[rows] = coords
+        if not transformable:
+            entry.model = None
+        self._put(key, entry)
+
+    def embed(self, method, feats, indices, make_model, params=None, transformable=True, n_components=3):
+        indices = np.asarray(indices, dtype=np.int64)
+        key, entry, missing = self.lookup(method, feats, indices, params, transformable, n_components)
+        if len(missing) == 0:
+            return entry.embedded[indices]
+        if entry.model is None:
+            model = make_model()
+            self.update(key, entry, indices, model.fit_transform(feats[indices, :]), model, transformable)
+        else:
+            self.update(key, entry, missing, entry.model.transform(feats[missing, :]), transformable=transformable)
+        return entry.embedded[indices]
+
+MODEL_CACHE = ModelCache(max_entries=int(os.environ.get('MODEL_CACHE_SIZE', 8)),
+                         cache_dir=os.environ.get('MODEL_CACHE_DIR'),
+                         shared=RESULT_STORE)
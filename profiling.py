@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+from collections import defaultdict, OrderedDict
+
+import pandas as pd
+import streamlit as st
+
+
+PROFILE_LOG = os.environ.get('PROFILE_LOG')
+PROFILE_ALLOCATIONS = os.environ.get('PROFILE_ALLOCATIONS', '') not in ('', '0')
+
+
+class RerunProfile:
+    def __init__(self, track_allocations=False):
+        self.started = time.time()
+        self.start_clock = time.perf_counter()
+        self.track_allocations = track_allocations
+        self.spans = []
+        self.cache = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self.depth = 0
+
+    def as_dict(self):
+        return {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(self.started)),
+                'total_seconds': time.perf_counter() - self.start_clock,
+                'spans': self.spans,
+                'cache': dict(self.cache)}
+
+
+class Profiler:
+    def __init__(self, log_path=PROFILE_LOG, track_allocations=PROFILE_ALLOCATIONS):
+        self.log_path = log_path
+        self.track_allocations = track_allocations
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        # tracemalloc is process-wide and sessions rerun on their own
+        # threads, so tracing started here stops when the last tracking run
+        # finishes.
+        self.tracking_runs = 0
+        self.owns_tracing = False
+
+    @property
+    def misses(self):
+        if not hasattr(self.local, 'misses'):
+            self.local.misses = defaultdict(int)
+        return self.local.misses
+
+    @property
+    def run(self):
+        return getattr(self.local, 'run', None)
+
+    def start_run(self, track_allocations=None):
+        track = self.track_allocations if track_allocations is None else track_allocations
+        if track:
+            with self.lock:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start()
+                    self.owns_tracing = True
+                self.tracking_runs += 1
+        self.local.run = RerunProfile(track)
+        return self.local.run
+
+    @contextmanager
+    def span(self, name):
+        run = self.run
+        if run is None:
+            yield
+            return
+        record = {'name': name, 'depth': run.depth}
+        run.spans.append(record)
+        run.depth += 1
+        before = tracemalloc.get_traced_memory()[0] if run.track_allocations and tracemalloc.is_tracing() else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if before is not None:
+                record['alloc_bytes'] = tracemalloc.get_traced_memory()[0] - before
+            run.depth -= 1
+
+    def record_cache(self, name, hit):
+        field = 'hits' if hit else 'misses'
+        with self.lock:
+            self.totals[name][field] += 1
+        if self.run is not None:
+            self.run.cache[name][field] += 1
+
+    def cached(self, name=None, **cache_kwargs):
+        # st.cache with hit/miss counters: the inner function only runs on a
+        # miss, the outer one on every call.
+        def decorator(fn):
+            label = name or fn.__name__
+
+            @functools.wraps(fn)
+            def miss(*args, **kwargs):
+                self.misses[label] += 1
+                return fn(*args, **kwargs)
+
+            # st.cache hashes the closure of miss; the profiler itself is
+            # process-wide state and must not change the cache key.
+            kwargs = dict(cache_kwargs)
+            kwargs['hash_funcs'] = dict(kwargs.get('hash_funcs') or {})
+            kwargs['hash_funcs'][Profiler] = id
+            cached_fn = st.cache(**kwargs)(miss)
+
+            @functools.wraps(fn)
+            def call(*args, **kwargs):
+                before = self.misses[label]
+                with self.span(label):
+                    result = cached_fn(*args, **kwargs)
+                self.record_cache(label, self.misses[label] == before)
+                return result
+            return call
+        return decorator
+
+    def finish_run(self):
+        run = self.run
+        if run is None:
+            return None
+        self.local.run = None
+        if run.track_allocations:
+            with self.lock:
+                self.tracking_runs -= 1
+                if self.tracking_runs == 0 and self.owns_tracing:
+                    tracemalloc.stop()
+                    self.owns_tracing = False
+        record = run.as_dict()
+        if self.log_path:
+            with self.lock, open(self.log_path, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+        return record
+
+    def cache_table(self):
+        with self.lock:
+            return pd.DataFrame.from_dict(OrderedDict(sorted(self.totals.items())), orient='index')
+
+
+PROFILER = Profiler()
+
+
+def show_profile(record, container=st.sidebar):
+    container.subheader('Profile of the last run')
+    container.write('Total: {:.3f}s'.format(record['total_seconds']))
+    spans = pd.DataFrame(record['spans'])
+    if spans.shape[0] > 0:
+        spans.loc[:, 'name'] = ['  ' * d + n for d, n in zip(spans.loc[:, 'depth'], spans.loc[:, 'name'])]
+        container.dataframe(spans.drop(columns='depth').set_index('name'))
+    if record['cache']:
+        container.write('Cache hits/misses (this run)')
+        container.dataframe(pd.DataFrame.from_dict(record['cache'], orient='index'))
+    container.write('Cache hits/misses (since start)')
+    container.dataframe(PROFILER.cache_table())
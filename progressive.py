@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from sklearn.decomposition import IncrementalPCA
+from sklearn.neighbors import NearestNeighbors
+
+from model_cache import array_digest, params_digest
+from dimension_reduction import tsne_model, umap_model
+
+
+_permutations = {}
+
+
+def stable_permutation(n, seed=0):
+    key = (n, seed)
+    if key not in _permutations:
+        _permutations[key] = np.random.RandomState(seed).permutation(n)
+    return _permutations[key]
+
+
+def refine_schedule(n, first=250, factor=2):
+    sizes = []
+    size = min(first, n)
+    while size < n:
+        sizes.append(size)
+        size *= factor
+    sizes.append(n)
+    return sizes
+
+
+def seed_new_points(feats, known, coords, new, jitter=1e-2, seed=0):
+    # New points start next to their nearest already-embedded neighbour.
+    nn = NearestNeighbors(n_neighbors=1).fit(feats[known])
+    nearest = nn.kneighbors(feats[new], return_distance=False)[:, 0]
+    rng = np.random.RandomState(seed)
+    scale = jitter * coords.std(axis=0)
+    return coords[nearest] + rng.randn(len(new), coords.shape[1]) * scale
+
+
+class ProgressiveState:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.indices = np.empty(0, dtype=np.int64)
+        self.coords = None
+        self.model = None
+
+
+def _step_pca(state, params, feats, indices, new):
+    # IncrementalPCA needs a batch of at least n_components rows, so until the
+    # sample has that many the points sit at the origin, and the first fit
+    # takes every row seen so far.
+    if state.model is None:
+        if len(indices) < 3:
+            return np.zeros((len(indices), 3), dtype=np.float32)
+        state.model = IncrementalPCA(n_components=3)
+        state.model.partial_fit(feats[indices, :])
+    elif len(new) >= 3:
+        state.model.partial_fit(feats[new, :])
+    return state.model.transform(feats[indices, :])
+
+
+def _warm_init(state, feats, new):
+    if state.coords is None:
+        return None
+    seeded = seed_new_points(feats, state.indices, state.coords, new)
+    return np.vstack([state.coords, seeded]).astype(np.float32)
+
+
+def _step_tsne(state, params, feats, indices, new):
+    init = _warm_init(state, feats, new)
+    if init is None:
+        model = tsne_model(**params)
+    else:
+        model = tsne_model(init=init, warm_start=True, **params)
+    return model.fit_transform(feats[indices, :])
+
+
+def _step_umap(state, params, feats, indices, new):
+    init = _warm_init(state, feats, new)
+    if init is None:
+        model = umap_model(**params)
+    else:
+        model = umap_model(init=init, warm_start=True, **params)
+    return model.fit_transform(feats[indices, :])
+
+
+STEPS = {'pca': _step_pca,
+         'tsne': _step_tsne,
+         'umap': _step_umap}
+
+
+class ProgressiveEmbedder:
+    def __init__(self, max_states=8):
+        self.max_states = max_states
+        self.states = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _state(self, key):
+        with self.lock:
+            if key not in self.states:
+                self.states[key] = ProgressiveState()
+            self.states.move_to_end(key)
+            while len(self.states) > self.max_states:
+                self.states.popitem(last=False)
+            return self.states[key]
+
+    def step(self, method, params, feats, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        if len(indices) == 0:
+            return np.empty((0, 3), dtype=np.float32)
+        state = self._state(params_digest(method, params) + '-' + array_digest(feats))
+        with state.lock:
+            m = len(state.indices)
+            if len(indices) <= m and np.array_equal(state.indices[:len(indices)], indices):
+                return state.coords[:len(indices)]
+            if m == 0 or not np.array_equal(indices[:m], state.indices):
+                state.reset()
+            new = indices[len(state.indices):]
+            coords = STEPS[method](state, params, feats, indices, new)
+            state.indices = indices.copy()
+            state.coords = np.asarray(coords, dtype=np.float32)
+            return state.coords
+
+    def covers(self, method, params, feats, indices):
+        state = self._state(params_digest(method, params) + '-' + array_digest(feats))
+        with state.lock:
+            return len(indices) <= len(state.indices) and np.array_equal(state.indices[:len(indices)], indices)
+
+    def embed(self, method, params, feats, indices, first=250):
+        # A rerun whose sample is already embedded skips straight to the
+        # final step instead of replaying every refinement.
+        indices = np.asarray(indices, dtype=np.int64)
+        if self.covers(method, params, feats, indices):
+            schedule = [len(indices)]
+        else:
+            schedule = refine_schedule(len(indices), first=first)
+        for n in schedule:
+            yield n, self.step(method, params, feats, indices[:n])
+
+
+PROGRESSIVE = ProgressiveEmbedder()
@@ -0,0 +1,239 @@
+import os
+import glob
+import json
+import time
+import zlib
+import pickle
+import sqlite3
+import hashlib
+import functools
+import threading
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+# Bump when the layout of stored results changes so old entries are ignored.
+STORE_VERSION = 1
+DEFAULT_TTL = 7 * 24 * 3600
+DEFAULT_MAX_BYTES = 1024 * 2 ** 20
+
+
+def frame_digest(data):
+    h = hashlib.sha1(str((list(data.columns), [str(t) for t in data.dtypes])).encode())
+    h.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+    return h.hexdigest()
+
+
+def value_digest(value):
+    if isinstance(value, pd.DataFrame):
+        return frame_digest(value)
+    if isinstance(value, pd.Series):
+        return frame_digest(value.to_frame())
+    if isinstance(value, np.ndarray) or sp.issparse(value) or hasattr(value, 'base_array'):
+        from model_cache import array_digest
+        return array_digest(value)
+    return json.dumps(value, sort_keys=True, default=str)
+
+
+def make_key(namespace, *parts):
+    digests = [STORE_VERSION, namespace] + [value_digest(p) for p in parts]
+    return hashlib.sha1(json.dumps(digests).encode()).hexdigest()
+
+
+def dumps(value, level=3):
+    return zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), level)
+
+
+def loads(blob):
+    return pickle.loads(zlib.decompress(blob))
+
+
+class NullBackend:
+    def get(self, key):
+        return None
+
+    def put(self, key, blob, ttl):
+        pass
+
+
+class DiskBackend:
+    # One file per key; the modification time is bumped on every read so
+    # eviction removes the least recently used files first.
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key + '.z')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                expires = float(f.readline())
+                blob = f.read()
+        except (IOError, ValueError):
+            return None
+        if expires < time.time():
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return blob
+
+    def put(self, key, blob, ttl):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = '{}.{:d}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write('{:.3f}\n'.format(time.time() + ttl).encode())
+            f.write(blob)
+        os.replace(tmp, path)
+        self.evict()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def evict(self):
+        files = []
+        for path in glob.glob(os.path.join(self.root, '*', '*.z')):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+
+class SQLiteBackend:
+    def __init__(self, path, max_bytes=DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self.connection as db:
+            db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB, size INTEGER, '
+                       'expires REAL, accessed REAL)')
+            db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+    @property
+    def connection(self):
+        if not hasattr(self.local, 'db'):
+            self.local.db = sqlite3.connect(self.path, timeout=30)
+        return self.local.db
+
+    def get(self, key):
+        now = time.time()
+        with self.connection as db:
+            row = db.execute('SELECT value, expires FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                db.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+            db.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+        return bytes(row[0])
+
+    def put(self, key, blob, ttl):
+        now = time.time()
+        with self.connection as db:
+            db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                       (key, sqlite3.Binary(blob), len(blob), now + ttl, now))
+            db.execute('DELETE FROM results WHERE expires < ?', (now,))
+            total = db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+            if total > self.max_bytes:
+                for old_key, size in db.execute('SELECT key, size FROM results ORDER BY accessed').fetchall():
+                    if total <= self.max_bytes:
+                        break
+                    db.execute('DELETE FROM results WHERE key = ?', (old_key,))
+                    total -= size
+
+
+class RedisBackend:
+    # Size-based eviction is left to the server: run it with maxmemory and
+    # an allkeys-lru policy.
+    def __init__(self, url, prefix='crime-results:'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def put(self, key, blob, ttl):
+        self.client.set(self.prefix + key, blob, ex=int(ttl))
+
+
+def backend_from_url(url, max_bytes=DEFAULT_MAX_BYTES):
+    if not url:
+        return NullBackend()
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisBackend(url)
+    if url.startswith('sqlite:///'):
+        return SQLiteBackend(url[len('sqlite:///'):], max_bytes)
+    if url.startswith('file:///'):
+        return DiskBackend(url[len('file://'):], max_bytes)
+    raise ValueError('Unsupported result store URL: {}'.format(url))
+
+
+class ResultStore:
+    def __init__(self, backend=None, ttl=DEFAULT_TTL):
+        self.backend = backend or NullBackend()
+        self.ttl = ttl
+
+    @property
+    def enabled(self):
+        return not isinstance(self.backend, NullBackend)
+
+    def get(self, key):
+        # The shared store is an optimisation; if it is unreachable or holds
+        # something unreadable the result is simply recomputed.
+        if not self.enabled:
+            return None
+        try:
+            blob = self.backend.get(key)
+            return None if blob is None else loads(blob)
+        except Exception:
+            return None
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        try:
+            self.backend.put(key, dumps(value), self.ttl)
+        except Exception:
+            pass
+
+    def memoize(self, namespace):
+        def decorator(fn):
+            @functools.wraps(fn)
+            def call(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                key = make_key(namespace, sorted(kwargs), *(list(args) + [kwargs[k] for k in sorted(kwargs)]))
+                result = self.get(key)
+                if result is None:
+                    result = fn(*args, **kwargs)
+                    self.put(key, result)
+                return result
+            return call
+        return decorator
+
+
+RESULT_STORE = ResultStore(backend_from_url(os.environ.get('RESULT_STORE_URL'),
+                                            int(float(os.environ.get('RESULT_STORE_MAX_MB', 1024)) * 2 ** 20)),
+                           ttl=float(os.environ.get('RESULT_STORE_TTL', DEFAULT_TTL)))
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+
+
+def sample_order(n, seed=0, strata=None, min_per_stratum=1):
+    # Every prefix of the returned order is a sample, so growing the sample
+    # size extends the previous sample instead of redrawing it.
+    rng = np.random.RandomState(seed)
+    perm = rng.permutation(n)
+    if strata is None:
+        return perm
+    codes = pd.factorize(np.asarray(strata)[perm])[0] + 1
+    sizes = np.bincount(codes)
+    by_code = np.argsort(codes, kind='stable')
+    starts = np.cumsum(sizes) - sizes
+    pos = np.empty(n, dtype=np.int64)
+    pos[by_code] = np.arange(n) - np.repeat(starts, sizes)
+    jitter = rng.random_sample(n)
+    # Interleave strata proportionally, but put the first few rows of every
+    # stratum in front so rare ones survive small samples.
+    key = (pos + jitter) / sizes[codes]
+    head = pos < min_per_stratum
+    key[head] = pos[head] - min_per_stratum + jitter[head]
+    return perm[np.argsort(key, kind='stable')]
+
+
+def nested_sample(data, n, seed=0, stratify_by=None, order=None):
+    if order is None:
+        strata = data.loc[:, stratify_by].to_numpy() if stratify_by else None
+        order = sample_order(data.shape[0], seed, strata)
+    return data.iloc[order[:n]]
+
+
+def allocate(counts, n):
+    # Largest-remainder split of n rows across groups in proportion to their
+    # sizes, never asking a group for more rows than it has.
+    counts = np.asarray(counts, dtype=np.int64)
+    total = counts.sum()
+    n = min(int(n), int(total))
+    if n <= 0:
+        return np.zeros(len(counts), dtype=np.int64)
+    exact = counts * (n / total)
+    sizes = np.minimum(np.floor(exact).astype(np.int64), counts)
+    remainder = exact - sizes
+    for i in np.argsort(-remainder, kind='stable')[:n - sizes.sum()]:
+        sizes[i] += 1
+    return sizes
+
+
+def allocated_prefix(data, n, by):
+    # Rows of every group must already be in sample order; each group then
+    # contributes its first allocate()-ed rows.
+    codes, groups = pd.factorize(data.loc[:, by])
+    counts = np.bincount(codes, minlength=len(groups))
+    sizes = allocate(counts, n)
+    by_code = np.argsort(codes, kind='stable')
+    pos = np.empty(len(codes), dtype=np.int64)
+    starts = np.cumsum(counts) - counts
+    pos[by_code] = np.arange(len(codes)) - np.repeat(starts, counts)
+    return data[pos < sizes[codes]]
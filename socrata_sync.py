@@ -0,0 +1,104 @@
+import os
+import json
+
+import pandas as pd
+import requests
+
+from crime_store import (STORE_DIR, has_partition, read_partition, replace_partition,
+                         normalize_frame, parse_dates)
+
+
+DOMAIN_URL = 'https://data.cityofchicago.org'
+DATASET_ID = 'ijzp-q8t2'
+SODA_DATE_FORMAT = '%Y-%m-%dT%H:%M:%S.000'
+
+
+def state_path(root=STORE_DIR):
+    return os.path.join(root, 'sync_state.json')
+
+
+def load_state(root=STORE_DIR):
+    try:
+        with open(state_path(root)) as f:
+            return json.load(f)
+    except (IOError, ValueError):
+        return {}
+
+
+def save_state(state, root=STORE_DIR):
+    os.makedirs(root, exist_ok=True)
+    tmp = state_path(root) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, state_path(root))
+
+
+def max_updated_on(data):
+    if data.shape[0] == 0:
+        return None
+    parsed, _ = parse_dates(data.loc[:, 'Updated On'])
+    latest = parsed.max()
+    if pd.isnull(latest):
+        return None
+    return latest.strftime(SODA_DATE_FORMAT)
+
+
+def high_water_mark(year, root=STORE_DIR):
+    state = load_state(root)
+    mark = state.get(str(year))
+    if mark is None and has_partition(year, root):
+        mark = max_updated_on(read_partition(year, columns=['Updated On'], root=root))
+    return mark
+
+
+def fetch_pages(year, since=None, base_url=DOMAIN_URL, dataset=DATASET_ID,
+                page_size=50000, app_token=None, session=None, timeout=60):
+    session = session or requests.Session()
+    headers = {'X-App-Token': app_token} if app_token else {}
+    where = 'year={:d}'.format(int(year))
+    if since is not None:
+        where += " AND updated_on >= '{}'".format(since)
+    url = '{}/resource/{}.json'.format(base_url.rstrip('/'), dataset)
+    offset = 0
+    while True:
+        params = {'$where': where,
+                  '$order': 'updated_on, id',
+                  '$limit': page_size,
+                  '$offset': offset}
+        response = session.get(url, params=params, headers=headers, timeout=timeout)
+        response.raise_for_status()
+        page = response.json()
+        if page:
+            yield page
+        if len(page) < page_size:
+            break
+        offset += page_size
+
+
+def merge_records(current, delta):
+    if current is None or current.shape[0] == 0:
+        merged = delta
+    else:
+        merged = pd.concat([current.astype({c: object for c in current.columns if current[c].dtype.name == 'category'}),
+                            delta.astype({c: object for c in delta.columns if delta[c].dtype.name == 'category'})],
+                           ignore_index=True)
+    merged = merged.drop_duplicates('ID', keep='last').sort_values('ID')
+    return normalize_frame(merged)
+
+
+def sync_year(year, root=STORE_DIR, **fetch_kwargs):
+    since = high_water_mark(year, root)
+    frames = [normalize_frame(pd.DataFrame.from_records(page))
+              for page in fetch_pages(year, since=since, **fetch_kwargs)]
+    if not frames:
+        return 0
+    delta = pd.concat(frames, ignore_index=True)
+    delta = delta[delta.loc[:, 'Year'] == int(year)]
+    current = read_partition(year, columns=None, root=root) if has_partition(year, root) else None
+    replace_partition(merge_records(current, delta), year, root)
+    marks = [m for m in [since, max_updated_on(delta)] if m is not None]
+    if marks:
+        state = load_state(root)
+        state[str(year)] = max(marks)
+        save_state(state, root)
+    return delta.shape[0]
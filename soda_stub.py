@@ -0,0 +1,128 @@
+import re
+import json
+import argparse
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import pandas as pd
+
+from crime_store import NAME_MAP, parse_dates
+from socrata_sync import DATASET_ID, SODA_DATE_FORMAT
+
+
+# A local stand-in for the Socrata resource endpoint, covering just what
+# fetch_pages asks for: a $where of ANDed comparisons, $order, $limit and
+# $offset. sync_year can be pointed at it with base_url.
+CLAUSE = re.compile(r"\s*(\w+)\s*(>=|<=|=|>|<)\s*'?([^']*)'?\s*$")
+NUMERIC_FIELDS = {'id', 'year'}
+OPERATORS = {'=': lambda a, b: a == b, '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+             '<': lambda a, b: a < b, '<=': lambda a, b: a <= b}
+
+
+def field_value(record, field):
+    value = record.get(field)
+    if field in NUMERIC_FIELDS and value is not None:
+        return float(value)
+    return value
+
+
+def parse_where(where):
+    clauses = []
+    for clause in re.split(r'\s+AND\s+', where, flags=re.IGNORECASE) if where else []:
+        match = CLAUSE.match(clause)
+        if match is None:
+            raise ValueError('Unsupported $where clause: {}'.format(clause))
+        field, op, value = match.groups()
+        clauses.append((field, OPERATORS[op], float(value) if field in NUMERIC_FIELDS else value))
+    return clauses
+
+
+def query(records, params):
+    clauses = parse_where(params.get('$where'))
+    rows = [r for r in records
+            if all(field_value(r, f) is not None and op(field_value(r, f), v) for f, op, v in clauses)]
+    order = [f.strip() for f in params.get('$order', '').split(',') if f.strip()]
+    if order:
+        rows.sort(key=lambda r: [field_value(r, f) for f in order])
+    offset = int(params.get('$offset', 0))
+    limit = int(params.get('$limit', 1000))
+    return rows[offset:offset + limit]
+
+
+def records_from_frame(data):
+    # Store-format rows (CSV column names and dates) as the JSON records the
+    # API returns: snake_case fields, ISO timestamps and string values.
+    data = data.rename(columns={v: k for k, v in NAME_MAP.items()})
+    data = data.loc[:, [c for c in data.columns if c in NAME_MAP]].copy()
+    for col in ['date', 'updated_on']:
+        if col in data.columns:
+            data[col] = parse_dates(data.loc[:, col].astype(object))[0].dt.strftime(SODA_DATE_FORMAT)
+    return [{k: str(v).lower() if isinstance(v, bool) else str(v) for k, v in row.items() if pd.notnull(v)}
+            for row in data.to_dict('records')]
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, records, dataset=DATASET_ID):
+        super().__init__(address, StubHandler)
+        self.records = records
+        self.dataset = dataset
+        self.requests = []
+
+    @property
+    def base_url(self):
+        return 'http://{}:{:d}'.format(*self.server_address[:2])
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/resource/{}.json'.format(self.server.dataset):
+            self.send_error(404)
+            return
+        params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.server.requests.append(params)
+        try:
+            body = json.dumps(query(self.server.records, params)).encode()
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def serve(records, host='127.0.0.1', port=0, dataset=DATASET_ID):
+    server = StubServer((host, port), records, dataset)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve a crimes CSV through a stand-in of the Socrata API.')
+    parser.add_argument('csv')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    args = parser.parse_args(argv)
+    records = records_from_frame(pd.read_csv(args.csv, dtype=object))
+    with serve(records, args.host, args.port) as server:
+        print('Serving {:d} records at {}'.format(len(records), server.base_url))
+        threading.Event().wait()
+
+
+if __name__ == '__main__':
+    main()
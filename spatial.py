@@ -0,0 +1,53 @@
+import numpy as np
+
+
+HEX_RADII = {'Fine': 100, 'Medium': 250, 'Coarse': 600}
+ORIGIN_LATITUDE = 41.8
+METERS_PER_DEGREE_LAT = 110540.0
+
+
+def _meters_per_degree_lon(lat0=ORIGIN_LATITUDE):
+    return 111320.0 * np.cos(np.radians(lat0))
+
+
+def hex_bin(lon, lat, radius, lat0=ORIGIN_LATITUDE):
+    # Axial coordinates of the pointy-top hexagon (center-to-corner radius in
+    # meters) that contains each point, on a local equirectangular projection.
+    x = np.asarray(lon, dtype=np.float64) * _meters_per_degree_lon(lat0)
+    y = np.asarray(lat, dtype=np.float64) * METERS_PER_DEGREE_LAT
+    q = (np.sqrt(3) / 3 * x - y / 3) / radius
+    r = (2.0 / 3 * y) / radius
+    s = -q - r
+    rq, rr, rs = np.round(q), np.round(r), np.round(s)
+    dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+    fix_q = (dq > dr) & (dq > ds)
+    fix_r = ~fix_q & (dr > ds)
+    rq[fix_q] = -rr[fix_q] - rs[fix_q]
+    rr[fix_r] = -rq[fix_r] - rs[fix_r]
+    return rq.astype(np.int64), rr.astype(np.int64)
+
+
+def hex_centers(q, r, radius, lat0=ORIGIN_LATITUDE):
+    x = radius * np.sqrt(3) * (q + r / 2.0)
+    y = radius * 1.5 * r
+    return x / _meters_per_degree_lon(lat0), y / METERS_PER_DEGREE_LAT
+
+
+def spatial_bins(data, radius, by=('Hour',)):
+    by = list(by)
+    points = data.loc[:, by + ['Longitude', 'Latitude']].dropna()
+    q, r = hex_bin(points.loc[:, 'Longitude'], points.loc[:, 'Latitude'], radius)
+    keys = points.loc[:, by].assign(q=q, r=r)
+    bins = keys.groupby(by + ['q', 'r'], observed=True, sort=False).size().rename('Count').reset_index()
+    bins['Longitude'], bins['Latitude'] = hex_centers(bins['q'].to_numpy(), bins['r'].to_numpy(), radius)
+    bins['Count'] = bins['Count'].astype(np.int32)
+    return bins
+
+
+def cells_for(bins, hour=None, years=None):
+    if hour is not None:
+        bins = bins[bins.loc[:, 'Hour'] == hour]
+    if years is not None:
+        bins = bins[bins.loc[:, 'Year'].isin(years)]
+    cells = bins.groupby(['q', 'r'], sort=False).agg({'Count': 'sum', 'Longitude': 'first', 'Latitude': 'first'})
+    return cells.reset_index(drop=True)
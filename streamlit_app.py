@@ -1,130 +1,306 @@
 import streamlit as st
 import numpy as np
 import pandas as pd
-import random
 import pydeck as pdk
-import datetime
 import altair as alt
-import sklearn
-import sodapy
-import plotly
+import time
+import hashlib
 
-from sklearn.decomposition import PCA, KernelPCA
-from sklearn.manifold import TSNE
 from sodapy import Socrata
 import plotly.express as px
+from streamlit.report_thread import get_report_ctx
 
-from datasets import *
-from dimension_reduction import *
+from datasets import LazyFeatures, mnist_csv
+from crime_store import (SUBSET_URL, extra_columns, LOAD_COLUMNS, has_partition, ingest_csv, normalize_frame,
+                         partition_rows, read_years, concat_frames, source_years)
+from socrata_sync import sync_year
+from features import ONE_HOT_COLUMNS, build_encoders, preprocess_data
+from progressive import PROGRESSIVE, stable_permutation
+from model_cache import MODEL_CACHE, array_digest
+from knn_graph import KNN_CACHE
+from jobs import JOBS, PENDING, RUNNING, DONE
+from aggregates import crime_cube, downsample_points
+from spatial import HEX_RADII, spatial_bins, cells_for
+from filters import FilterIndex
+from sampling import nested_sample, allocate, allocated_prefix
+from profiling import PROFILER, show_profile
+from result_store import RESULT_STORE, ResultStore
+from lod import MAX_DISPLAY_POINTS, display_points
+from evaluation import DEFAULT_K, evaluate, tracked, tracked_steps
+from dimension_reduction import TRANSFORMABLE, embed, fit_model, transform_rows
 
 
 global_hour = -1
 
-def get_month(time):
-    try:
-        dt = datetime.datetime.strptime(time, '%m/%d/%Y %I:%M:%S %p')
-    except:
-        dt = datetime.datetime.strptime(time, '%Y-%m-%dT%H:%M:%S.000')
-    return dt.month
+def shared_cached(name, **cache_kwargs):
+    # st.cache in front of the cross-replica result store: a rerun only goes
+    # to the shared store when this process has not computed the result yet.
+    def decorator(fn):
+        hash_funcs = dict(cache_kwargs.pop('hash_funcs', {}))
+        hash_funcs[ResultStore] = id
+        return PROFILER.cached(name, hash_funcs=hash_funcs, **cache_kwargs)(RESULT_STORE.memoize(name)(fn))
+    return decorator
 
-def get_hour(time):
-    try:
-        dt = datetime.datetime.strptime(time, '%m/%d/%Y %I:%M:%S %p')
-    except:
-        dt = datetime.datetime.strptime(time, '%Y-%m-%dT%H:%M:%S.000')
-    return dt.hour
-
-def get_one_hot(ds):
-    values = list(ds.unique())
-    data_dict = {}
-    for value in values:
-        data_dict[value] = list(ds.apply(lambda x: x==value).astype(np.int))
-    one_hot = pd.DataFrame(data_dict)
-    return one_hot
-    # return one_hot
-
-@st.cache(suppress_st_warning=True)
-def read_data(year, mode='offline'):
-    name_map = {"id":'ID',
-        "case_number":'Case Number',
-        "date":'Date',
-        "block":'Block',
-        "iucr":'IUCR',
-        "primary_type":'Primary Type',
-        "description":'Description',
-        "location_description":'Location Description',
-        "arrest":'Arrest',
-        "domestic":'Domestic',
-        "beat":'Beat',
-        "district":'District',
-        "ward":'Ward',
-        "community_area":'Community Area',
-        "fbi_code":'FBI Code',
-        "year":'Year',
-        "updated_on":'Updated On',
-        "x_coordinate":'X Coordinate',
-        "y_coordinate":'Y Coordinate',
-        "latitude":'Latitude',
-        "longitude":'Longitude',
-        "location":'Location'
-    }
+MAX_SAMPLES = 100000
+
+def prepare_store(years, mode='offline'):
     if mode == 'offline':
-        try:
-            csv_cache = st.cache(pd.read_csv)
-            results = csv_cache('https://raw.githubusercontent.com/CMU-IDS-2020/a3-05839-a3-fch-ljy/master/subset.csv')
-            return results[results.loc[:,'Year']==year]
-        except: # For testing
-            st.write('Incomplete Data Readed, Only for testing')
-            client = Socrata("data.cityofchicago.org", None)
-            results = client.get("ijzp-q8t2", where="year={:d}".format(year), limit=100000)
-            results = pd.DataFrame.from_records(results)
-            results.columns = [name_map[name] for name in list(results.columns)]
-            return results[results.loc[:,'Year']==str(year)]
+        # The source is ingested once; years it does not contain are skipped
+        # rather than triggering another download.
+        if source_years(SUBSET_URL) is None and not all(has_partition(y) for y in years):
+            ingest_csv(SUBSET_URL)
     else:
-        client = Socrata("data.cityofchicago.org", None)
-        results = client.get_all("ijzp-q8t2", where="year={:d}".format(year))
-        results = pd.DataFrame.from_records(results)
-        results.columns = [name_map[name] for name in list(results.columns)]
-        return results[results.loc[:,'Year']==str(year)]
+        for year in years:
+            sync_year(year)
+
+def sample_years(frames, seed=0, stratify_by=None):
+    # Only the largest sample the sidebar can ask for is kept, spread over
+    # the years in proportion to their size and stored in sample order, so
+    # memory does not grow with the length of the year range.
+    sizes = dict(zip(frames, allocate(list(frames.values()), MAX_SAMPLES)))
+    return lambda year, data: nested_sample(data, sizes.get(year, 0), seed=seed + year, stratify_by=stratify_by)
+
+@shared_cached('read_data')
+def read_data(years, seed=0, stratify_by=None, mode='offline'):
+    prepare_store(years, mode)
+    stored = [y for y in years if has_partition(y)]
+    sample_year = sample_years({y: partition_rows(y) for y in stored}, seed, stratify_by)
+    return read_years(stored, columns=LOAD_COLUMNS, transform=sample_year)
 
-@st.cache
+# For testing: a degraded sample straight from the API. It is cached in this
+# process only, never in the shared result store, so a transient failure on
+# one replica is not served to the others.
+@PROFILER.cached()
+def fetch_data(years, seed=0, stratify_by=None):
+    client = Socrata("data.cityofchicago.org", None)
+    frames = {}
+    for year in years:
+        results = client.get("ijzp-q8t2", where="year={:d}".format(year), limit=100000)
+        results = normalize_frame(pd.DataFrame.from_records(results))
+        frames[year] = results[results.loc[:,'Year']==year].loc[:,LOAD_COLUMNS]
+    sample_year = sample_years({y: f.shape[0] for y, f in frames.items()}, seed, stratify_by)
+    return concat_frames([sample_year(y, f) for y, f in frames.items()], LOAD_COLUMNS)
+
+def load_data(years, seed=0, stratify_by=None, mode='offline'):
+    try:
+        data = read_data(years, seed, stratify_by, mode)
+    except (OSError, ValueError) as e:
+        st.write('Incomplete Data Readed, Only for testing ({})'.format(e))
+        return fetch_data(years, seed, stratify_by)
+    missing = [y for y in years if not has_partition(y)]
+    if missing:
+        st.warning('No records are stored for {}; they are left out.'.format(', '.join(str(y) for y in missing)))
+    return data
+
+@shared_cached('add_extra_columns', suppress_st_warning=True)
 def add_extra_columns(selected_data):
-    selected_data = selected_data.copy()
-    selected_data.loc[:,'Month'] = selected_data.loc[:,'Date'].apply(lambda x:get_month(x))
-    selected_data.loc[:,'Hour'] = selected_data.loc[:,'Date'].apply(lambda x:get_hour(x))
-    return selected_data.loc[:,['Date', 'Block', 'Primary Type', 'Description', 'Location Description', 'Arrest', 'Domestic', 'Community Area', "Year", 'Month', 'Latitude', 'Longitude', 'Case Number', 'Hour']]
+    selected_data, failed = extra_columns(selected_data)
+    if len(failed) > 0:
+        st.warning('{:d} records with unparseable dates were dropped, e.g. {}'.format(
+            len(failed), failed[:3]))
+    return selected_data
 
-@st.cache
+@PROFILER.cached()
 def random_select(data, target_num):
-    total_num = data.shape[0]
-    target_list = list(range(total_num))
-    random.shuffle(target_list)
-    target_list = target_list[:target_num]
-    return data.iloc[target_list].reset_index()
-
-def preprocess_data(data):
-    data_columns = data.loc[:,['Primary Type', 'Month', 'Hour', 'Location Description', 'Arrest', 'Domestic', 'Community Area', 'Latitude', 'Longitude']]
-    one_hot = [False, True, True, True, False, False, True, False, False]
-    var_list = data_columns.columns.unique()
-    data_columns = data_columns.dropna()
-    object_list = []
-    for i in range(8):
-        var_name = var_list[i]
-        if one_hot[i]:
-            obj = get_one_hot(data.loc[:,var_name])
-        else:
-            if var_name != 'Primary Type':
-                obj = data.loc[:,var_name].astype(np.float)
-            else:
-                obj = data.loc[:,var_name]
-        if var_name in ['Latitude', 'Longitude']:
-            obj = (obj-obj.mean())/obj.std()
-        object_list.append(obj)
-    data = pd.concat(object_list, axis=1)
-    data = data.dropna()
-    return data.iloc[:,0], np.array(data.iloc[:,1:])
+    return allocated_prefix(data, target_num, 'Year').reset_index()
+
+def no_params(feats):
+    return {}
+
+def kpca_params(feats):
+    kernel = st.selectbox('Kernel', ['linear', 'poly', 'rbf', 'cosine'])
+    return {'kernel': kernel}
+
+def tsne_params(feats):
+    perplexity = st.slider('Perplexity',
+                           min_value=5,
+                           max_value=50,
+                           value=30,
+                           step=1)
+    return {'perplexity': perplexity}
+
+def umap_params(feats):
+    metric = st.selectbox('Metric', [
+        'euclidean',
+        'manhattan',
+        'chebyshev',
+        'minkowski',
+        'canberra',
+        'braycurtis',
+        'mahalanobis',
+        'wminkowski',
+        'seuclidean',
+        'cosine',
+        'correlation'
+    ])
+    n_neighbors = st.slider('N Neighbors',
+                            min_value=2,
+                            max_value=200,
+                            value=15,
+                            step=1)
+    min_dist = st.slider('Minimum Distance',
+                            min_value=0.0,
+                            max_value=1.0,
+                            value=0.1,
+                            step=0.01)
+    return {'n_neighbors': n_neighbors,
+            'min_dist': min_dist,
+            'metric': metric}
+
+def ae_params(feats):
+    n_features = feats.shape[1]
+    hidden_size = st.slider('Hidden Size',
+                            min_value=3,
+                            max_value=n_features,
+                            value=int(np.sqrt(n_features)),
+                            step=1)
+    n_epochs = st.slider('Number of Epochs',
+                            min_value=1,
+                            max_value=20,
+                            value=5,
+                            step=1)
+    activation = st.selectbox('Activation', [
+        None,
+        'relu',
+        'sigmoid',
+        'tanh'
+    ], index=1)
+    return {'hidden_size': hidden_size,
+            'n_epochs': n_epochs,
+            'activation': activation}
+
+ALGORITHMS = {'PCA': ('pca', no_params),
+              'KPCA': ('kpca', kpca_params),
+              'Isomap': ('isomap', no_params),
+              't-SNE': ('tsne', tsne_params),
+              'UMAP': ('umap', umap_params),
+              'Autoencoder': ('ae', ae_params)}
+EMBEDDING_MODES = ['Run In Background', 'Progressive Rendering']
+PROGRESSIVE_METHODS = ['pca', 'tsne', 'umap']
+# The autoencoder trains on the whole feature store, which is not shipped
+# to worker processes.
+BACKGROUND_METHODS = ['pca', 'kpca', 'isomap', 'tsne', 'umap']
+
+def session_slot(name):
+    ctx = get_report_ctx()
+    return '{}:{}'.format(ctx.session_id if ctx is not None else 'main', name)
+
+def run_job(key, fn, *args):
+    slot = session_slot('embedding')
+    job = JOBS.submit(slot, key, fn, *args)
+    status = st.empty()
+    while JOBS.poll(job) in (PENDING, RUNNING):
+        status.text('Computing the embedding in the background...')
+        time.sleep(0.25)
+    status.empty()
+    if job.state != DONE:
+        st.error('The embedding failed: {}'.format(job.error))
+        return None
+    return JOBS.take(job, slot)
+
+def background_embedding(method, params, feats, indices, trace_memory=False):
+    # Goes through MODEL_CACHE like embed(): only rows it does not hold yet
+    # are computed, in a worker, by fitting or by transforming with the
+    # cached model. k-NN graphs travel with the job in both directions, and
+    # the fit cost comes back from the worker with the embedding.
+    transformable = method in TRANSFORMABLE
+    key, entry, missing = MODEL_CACHE.lookup(method, feats, indices, params, transformable)
+    if len(missing) == 0:
+        return entry.embedded[indices], {}
+    if entry.model is None:
+        X = feats[indices, :]
+        job_key = '-'.join([key, 'fit', hashlib.sha1(np.asarray(indices, dtype=np.int64).tobytes()).hexdigest()])
+        result = run_job(job_key, fit_model, method, params, X, KNN_CACHE.indexes_for(X), trace_memory)
+        if result is None:
+            return None, {}
+        model, coords, knn_indexes, cost = result
+        KNN_CACHE.add(X, knn_indexes)
+        MODEL_CACHE.update(key, entry, indices, coords, model, transformable)
+    else:
+        job_key = '-'.join([key, 'transform', hashlib.sha1(missing.tobytes()).hexdigest()])
+        result = run_job(job_key, transform_rows, entry.model, feats[missing, :], trace_memory)
+        if result is None:
+            return None, {}
+        coords, cost = result
+        MODEL_CACHE.update(key, entry, missing, coords, transformable=transformable)
+    return entry.embedded[indices], cost
+
+def display_controls():
+    max_points = st.slider('Max Displayed Points', 1000, 20000, value=MAX_DISPLAY_POINTS, step=1000)
+    box = None
+    if st.checkbox('Zoom Into Region'):
+        box = [st.slider('{} Range (% of extent)'.format(axis), 0, 100, value=(0, 100), step=1)
+               for axis in ['X', 'Y', 'Z']]
+        box = [(low / 100.0, high / 100.0) for low, high in box]
+    return max_points, box
+
+def plot_embedding(results, labels, placeholder=None, view=(MAX_DISPLAY_POINTS, None)):
+    max_points, box = view
+    with PROFILER.span('level of detail'):
+        coords, shown, counts = display_points(results, labels, box, max_points)
+    reduced = pd.DataFrame(coords, columns=['x', 'y', 'z'])
+    reduced.loc[:,'class'] = shown
+    reduced.loc[:,'points'] = counts
     
-def visualize_ml(selected_data):
+    if len(counts) < len(labels) and counts.max() > 1:
+        title = 'Showing {:d} representatives of {:d} points'.format(len(counts), len(labels))
+        fig = px.scatter_3d(reduced, x='x', y='y', z='z', color='class', size=np.log2(counts) + 1, size_max=12,
+                            hover_data=['points'], opacity=1, title=title,
+                            category_orders={'class': sorted(set(labels))})
+    else:
+        fig = px.scatter_3d(reduced, x='x', y='y', z='z', color='class', opacity=1,
+                            category_orders={'class': sorted(set(labels))})
+    fig.update_layout(autosize=False,
+                      width=700,
+                      height=800)
+    with PROFILER.span('chart serialization'):
+        (placeholder or st).plotly_chart(fig)
+
+@PROFILER.cached(hash_funcs={np.ndarray: array_digest, LazyFeatures: array_digest})
+def embedding_metrics(feats, indices, results, label_codes):
+    return evaluate(feats[indices, :], results, label_codes)
+
+def show_metrics(algo_opt, feats, indices, labels, results, cost):
+    with PROFILER.span('embedding metrics'):
+        metrics = embedding_metrics(feats, np.asarray(indices), np.asarray(results, dtype=np.float32),
+                                    pd.factorize(np.asarray(labels))[0])
+    table = pd.DataFrame([dict(cost, **metrics)], index=[algo_opt])
+    st.table(table.rename(columns={'fit_seconds': 'Fit Time (s)',
+                                   'peak_mb': 'Peak Memory (MB)',
+                                   'trustworthiness': 'Trustworthiness',
+                                   'continuity': 'Continuity',
+                                   'knn_accuracy': '{:d}-NN Label Accuracy'.format(DEFAULT_K)}))
+
+def embed_and_plot(algo_opt, feats, indices, labels, mode=EMBEDDING_MODES[0]):
+    method, params_ui = ALGORITHMS[algo_opt]
+    params = params_ui(feats)
+    view = display_controls()
+    show_quality = st.checkbox('Show Quality Metrics', value=True)
+    results = None
+    # Methods without a progressive variant fall back to the worker pool,
+    # and those that cannot be shipped to a worker run in the script.
+    if mode == 'Progressive Rendering' and method in PROGRESSIVE_METHODS:
+        status = st.empty()
+        placeholder = st.empty()
+        cost = {}
+        steps = tracked_steps(PROGRESSIVE.embed(method, params, feats, indices), cost, show_quality)
+        with PROFILER.span('embedding fit (progressive)'):
+            for n, results in steps:
+                status.text('Embedded {:d} of {:d} samples'.format(n, len(indices)))
+                plot_embedding(results, labels[:n], placeholder, view)
+    elif method in BACKGROUND_METHODS:
+        with PROFILER.span('embedding fit (background)'):
+            results, cost = background_embedding(method, params, feats, indices, show_quality)
+        if results is not None:
+            plot_embedding(results, labels, view=view)
+    else:
+        with PROFILER.span('embedding fit'), tracked(show_quality) as cost:
+            results = embed(method, feats, indices, params)
+        plot_embedding(results, labels, view=view)
+    if show_quality and results is not None and len(results) == len(indices):
+        show_metrics(algo_opt, feats, indices, labels, results, cost)
+
+def visualize_ml(selected_data, encoders=None):
     help_selected = st.checkbox('help')
     if help_selected:
         st.markdown('''
@@ -133,14 +309,11 @@ def visualize_ml(selected_data):
                     if we can use machine learning algorithms to make prediction. 
                     If the points are mixed together, you might try to reduce the number of crime types in the general setting panel.
                     ''')
-    labels, feats = preprocess_data(selected_data)
-    algorithms = {'PCA': pca,
-                  'KPCA': kpca,
-                  'Isomap': isomap,
-                  't-SNE': tsne,
-                  'UMAP': umap}
+    with PROFILER.span('preprocess_data'):
+        labels, feats = preprocess_data(selected_data, encoders)
+    algorithms = ['PCA', 'KPCA', 'Isomap', 't-SNE', 'UMAP']
     
-    algo_opt = st.selectbox('Select an algorithm:', list(algorithms.keys()))
+    algo_opt = st.selectbox('Select an algorithm:', algorithms)
     
     
     n_samples = st.slider('Number of Samples', 
@@ -148,20 +321,18 @@ def visualize_ml(selected_data):
                           max_value=len(feats), 
                           value=min(2500, len(feats)), 
                           step=1)
-    indices = np.arange(n_samples)
-    results = algorithms[algo_opt](feats, indices)
+    mode = st.radio('Embedding Mode', EMBEDDING_MODES)
+    indices = stable_permutation(len(feats))[:n_samples]
+    reduced_labels = labels.iloc[indices].to_numpy()
+    embed_and_plot(algo_opt, feats, indices, reduced_labels, mode)
 
-    reduced = pd.DataFrame(results, columns=['x', 'y', 'z'])
-    reduced_labels = labels.iloc[list(indices)].reset_index().iloc[:,1]
-    reduced.loc[:,'class'] = reduced_labels
-    
-    fig = px.scatter_3d(reduced, x='x', y='y', z='z', color='class', opacity=1)
-    fig.update_layout(autosize=False,
-                      width=700,
-                      height=800)
-    st.plotly_chart(fig)
+@shared_cached('cached_cube')
+def cached_cube(selected_data):
+    # No chart encodes Month, so it is left out of the cube; the sidebar's
+    # month filter is applied to the rows before they get here.
+    return crime_cube(selected_data, ['Primary Type', 'Location Description', 'Hour', 'Year'])
 
-def visualize_chart(selected_data):
+def visualize_chart(selected_data, max_geo_points=5000):
     st.header("Chart Visualization")
     help_selected = st.checkbox('help')
     if help_selected:
@@ -175,15 +346,20 @@ def visualize_chart(selected_data):
                     ''')
     selector_type = alt.selection_single(empty='all', fields=['Primary Type'])
     selector_loc = alt.selection_single(empty='all', fields=['Location Description'])
+    selector_year = alt.selection_multi(empty='all', fields=['Year'])
     brush = alt.selection(type='interval')
-    base = alt.Chart(selected_data).properties(
+    cube = cached_cube(selected_data)
+    multi_year = cube.loc[:,'Year'].nunique() > 1
+    geo_points = selected_data.loc[:,['Date', 'Block', 'Primary Type', 'Description', 'Location Description', 'Hour', 'Year', 'Latitude', 'Longitude']].dropna()
+    geo_points = downsample_points(geo_points, max_geo_points)
+    base = alt.Chart(cube).properties(
             width=300,
             height=300
         )
 
     points = base.mark_bar(filled=True).encode(
-            x=alt.X('Primary Type:N', sort=alt.EncodingSortField(field="Case Number", op="count", order='descending'),),
-            y=alt.Y('count(Case Number):Q'),
+            x=alt.X('Primary Type:N', sort=alt.EncodingSortField(field="Count", op="sum", order='descending'),),
+            y=alt.Y('sum(Count):Q', title='Case Number'),
             color=alt.condition(selector_type,
                                 'Primary Type:N',
                                 alt.value('lightgray')),
@@ -198,7 +374,7 @@ def visualize_chart(selected_data):
             )
     
     chart_main = base.mark_area(filled=True).encode(x='Hour:N',
-                                         y='count(Case Number):Q',
+                                         y=alt.Y('sum(Count):Q', title='Case Number'),
                                          color=alt.Color('Primary Type:N')).properties(
                                              title="Hourly Trend of Crime Types (Drag to Select)",
                                              ).add_selection(
@@ -212,9 +388,9 @@ def visualize_chart(selected_data):
     chart_location = base.mark_bar(filled=True).encode(
                 x=alt.X(
                     'Location Description:N',
-                    sort=alt.EncodingSortField(field="Case Number", op="count", order='descending'),
+                    sort=alt.EncodingSortField(field="Count", op="sum", order='descending'),
                 ),
-                y=alt.Y('count(Case Number):Q'),
+                y=alt.Y('sum(Count):Q', title='Case Number'),
                 color=alt.condition(
                     selector_loc,
                     'Primary Type:N',
@@ -240,7 +416,7 @@ def visualize_chart(selected_data):
                     height=400
                 )
         
-    geo_chart = base.mark_circle(
+    geo_chart = alt.Chart(geo_points).mark_circle(
             size=10
         ).encode(
             longitude='Longitude:Q',
@@ -248,7 +424,7 @@ def visualize_chart(selected_data):
             color='Primary Type:N',
             tooltip=['Date', 'Block', 'Primary Type', 'Description', 'Location Description']
         ).properties(
-                title="Geography Distribution (Details given in Points)",
+                title="Geography Distribution (Details given in {:d} Sampled Points)".format(geo_points.shape[0]),
                 width=700,
                 height=400
         ).transform_filter(
@@ -259,9 +435,40 @@ def visualize_chart(selected_data):
             selector_type
         )
         
-    st.altair_chart(alt.vconcat(two_chart, chart_location, background + geo_chart))
+    charts = [two_chart, chart_location, background + geo_chart]
+    if multi_year:
+        points, chart_main, chart_location, geo_chart = [c.transform_filter(selector_year) for c in
+                                                         [points, chart_main, chart_location, geo_chart]]
+        chart_year = base.mark_bar(filled=True).encode(
+                x='Year:O',
+                y=alt.Y('sum(Count):Q', title='Case Number'),
+                color=alt.condition(
+                    selector_year,
+                    'Primary Type:N',
+                    alt.value('lightgray')
+                ),
+            ).properties(
+                title="Yearly Trend (Click to Select)",
+                width=700,
+                height=200
+            ).add_selection(
+                selector_year
+            ).transform_filter(
+                selector_loc
+            ).transform_filter(
+                brush
+            ).transform_filter(
+                selector_type
+            )
+        charts = [points|chart_main, chart_location, chart_year, background + geo_chart]
+    with PROFILER.span('chart serialization'):
+        st.altair_chart(alt.vconcat(*charts))
     
 
+@shared_cached('cached_bins')
+def cached_bins(data, radius):
+    return spatial_bins(data, radius, by=('Hour', 'Year'))
+
 def visualize_map(data, crime_list = ['THEFT','BATTERY', 'CRIMINAL DAMAGE', 'NARCOTICS', 'ASSAULT', 'OTHER']):
     st.header("Map Visualization")
     help_selected = st.checkbox('help')
@@ -273,6 +480,9 @@ def visualize_map(data, crime_list = ['THEFT','BATTERY', 'CRIMINAL DAMAGE', 'NAR
                     You can zoom in/out to view the map in different detail level.
                     ''')
     options = st.multiselect("Visualization Type", ['HeatMap', 'ScatterPlot', 'Hexagon'], default=['ScatterPlot', 'Hexagon'])
+    detail = st.select_slider('Map Detail', list(HEX_RADII.keys()), value='Fine')
+    max_points = st.slider('Max Scatter Points', 1000, 20000, value=5000, step=1000)
+    radius = HEX_RADII[detail]
     view_in_hour = st.checkbox("View In Single Hour")
     global global_hour
     if view_in_hour:
@@ -280,22 +490,34 @@ def visualize_map(data, crime_list = ['THEFT','BATTERY', 'CRIMINAL DAMAGE', 'NAR
         selected_data = data[data.loc[:,'Hour']==hour]
         global_hour = hour
     else:
+        hour = None
         selected_data = data
         global_hour = -1
-    selected_data.loc[:,['Latitude','Longitude']] = selected_data.loc[:,['Latitude','Longitude']].astype(np.float)
+    years = sorted(data.loc[:,'Year'].unique())
+    if len(years) > 1 and st.checkbox("View In Single Year"):
+        year = st.select_slider('Select specific year', years, value=years[-1])
+        selected_data = selected_data[selected_data.loc[:,'Year']==year]
+        map_years = [year]
+    else:
+        map_years = None
     selected_data = selected_data.dropna()
+    cells = cells_for(cached_bins(data, radius), hour, map_years)
     view_state = pdk.ViewState(
         longitude=-87.65, latitude=41.8, pitch=40.5, bearing=-10, zoom=10
     )
     layers = []
     if 'Hexagon' in options:
+        max_count = max(int(cells.loc[:,'Count'].max()), 1) if cells.shape[0] > 0 else 1
         layer = pdk.Layer(
-            "HexagonLayer",
-            data=selected_data,
+            "ColumnLayer",
+            data=cells,
             get_position='[Longitude, Latitude]',
-            elevation_scale=8,
-            elevation_range=[0, 1500],
-            radius = 100,
+            get_elevation='Count',
+            elevation_scale=1500 / max_count,
+            get_fill_color='[255, 220 - 180 * Count / {:d}, 80, 220]'.format(max_count),
+            radius=radius,
+            disk_resolution=6,
+            angle=90,
             extruded=True,
             pickable=True,
             coverage=1)
@@ -310,10 +532,10 @@ def visualize_map(data, crime_list = ['THEFT','BATTERY', 'CRIMINAL DAMAGE', 'NAR
                     crime_data = selected_data[selected_data.loc[:,'Primary Type']==crime]
                 else:
                     target_list = crime_list[:-1]
-                    crime_data = selected_data[selected_data.loc[:,'Primary Type'].apply(lambda x:x not in target_list)]
+                    crime_data = selected_data[~selected_data.loc[:,'Primary Type'].isin(target_list)]
                 layer = pdk.Layer(
                     'ScatterplotLayer',    
-                    data=crime_data,
+                    data=downsample_points(crime_data, max_points // len(crime_list)),
                     get_position='[Longitude, Latitude]',
                     auto_highlight=True,
                     get_radius=100,
@@ -324,7 +546,7 @@ def visualize_map(data, crime_list = ['THEFT','BATTERY', 'CRIMINAL DAMAGE', 'NAR
         else:
             layer = pdk.Layer(
                 'ScatterplotLayer',
-                data=selected_data,
+                data=downsample_points(selected_data, max_points),
                 get_position='[Longitude, Latitude]',
                 auto_highlight=True,
                 get_radius=100,
@@ -334,59 +556,57 @@ def visualize_map(data, crime_list = ['THEFT','BATTERY', 'CRIMINAL DAMAGE', 'NAR
     if 'HeatMap' in options:
         layer = pdk.Layer(
             "HeatmapLayer",
-            data=selected_data,
+            data=cells,
             get_position='[Longitude, Latitude]',
+            get_weight='Count',
             opacity=0.5,
-            aggregation='"MEAN"')
+            aggregation='"SUM"')
         layers.append(layer)
-    deck_cache = st.cache(pdk.Deck)
-    deck = deck_cache(map_style='mapbox://styles/mapbox/light-v9',layers=layers, initial_view_state=view_state)
-    st.pydeck_chart(deck)
+    deck = build_deck(layers, view_state)
+    with PROFILER.span('chart serialization'):
+        st.pydeck_chart(deck)
+
+@PROFILER.cached()
+def build_deck(layers, view_state):
+    return pdk.Deck(map_style='mapbox://styles/mapbox/light-v9', layers=layers, initial_view_state=view_state)
+
+@PROFILER.cached(allow_output_mutation=True)
+def build_filter_index(selected_data):
+    return FilterIndex(selected_data)
 
 def main_chart():
     
     st.title("Exploring the Pattern of Chicago Crimes")
     
     #General data selection and preprocessing
-    year = st.sidebar.slider('Year', 2001, 2020, value=2020)
-    st.sidebar.write("Year Value Will Be Fixed Here (2020)")
-    year = 2020
-    num_of_samples = st.sidebar.slider('Total Case Number', 2000, 100000, value=10000, step=2000)
-    data_cache = st.cache(read_data)
-    results = data_cache(year)
+    first_year, last_year = st.sidebar.slider('Year', 2001, 2020, value=(2020, 2020))
+    years = tuple(range(first_year, last_year + 1))
+    num_of_samples = st.sidebar.slider('Total Case Number', 2000, MAX_SAMPLES, value=10000, step=2000)
+    stratify_by = st.sidebar.selectbox('Stratify Sample By', [None, 'Primary Type', 'Community Area'])
+    seed = st.sidebar.number_input('Sample Seed', min_value=0, value=0, step=1)
+    results = load_data(years, int(seed), stratify_by)
     selected_data = random_select(results, num_of_samples)
     selected_data = add_extra_columns(selected_data)
     
     #Detailed Selection
-    location_list = list(selected_data.groupby('Location Description').agg('count').sort_values('Case Number', ascending = False).index)
-    location_list = location_list[:15]+['OTHER']
-    
-    crime_list = list(selected_data.groupby('Primary Type').agg('count').sort_values('Case Number', ascending = False).index)
-    crime_list = crime_list[:10]+['OTHER']
+    index = build_filter_index(selected_data)
+    location_list = index.top('Location Description', 15)+['OTHER']
+    crime_list = index.top('Primary Type', 10)+['OTHER']
     
     crimetype = st.sidebar.multiselect('Crime Type', crime_list, default = crime_list[:-5])
     location = st.sidebar.multiselect('Location', location_list, default = location_list[:-1])
     month = st.sidebar.selectbox('Month', ['All Month'] +list(range(1,12)))
-    if crimetype != []:
-        if 'OTHER' not in crimetype:
-            selected_data = selected_data[selected_data.loc[:,'Primary Type'].apply(lambda x:x in crimetype)]
-        else:
-            target_list = crime_list
-            for crime in crimetype:
-                target_list.remove(crime)
-            selected_data = selected_data[selected_data.loc[:,'Primary Type'].apply(lambda x:x not in target_list)]
-            
-    if location != []:
-        if 'OTHER' not in location:
-            selected_data = selected_data[selected_data.loc[:,'Location Description'].apply(lambda x:x in location)]
-        else:
-            target_list = location_list
-            for loc in location:
-                target_list.remove(loc)
-            selected_data = selected_data[selected_data.loc[:,'Location Description'].apply(lambda x:x not in target_list)]
-    if month != 'All Month':
-        selected_data = selected_data[selected_data.loc[:,'Month']==month]
-    selected_data = selected_data.reset_index().iloc[:,1:]
+    if len(years) > 1:
+        year_list = st.sidebar.multiselect('Years', list(years), default=list(years))
+    else:
+        year_list = list(years)
+    with PROFILER.span('filtering'):
+        mask = index.select('Primary Type', crimetype, crime_list)
+        mask &= index.select('Location Description', location, location_list)
+        mask &= index.isin('Year', year_list)
+        if month != 'All Month':
+            mask &= index.equals('Month', month)
+        selected_data = selected_data[mask].reset_index(drop=True)
     st.subheader('Raw Data')
     st.write(selected_data)
     visualization_type = st.multiselect('Select the way you want to explore the data', ['Explore In Charts', 'Visualize In A Map', 'Machine Learning'], default = ['Explore In Charts'])
@@ -395,18 +615,11 @@ def main_chart():
     if 'Explore In Charts' in visualization_type:
         visualize_chart(selected_data)
     if 'Machine Learning' in visualization_type:
-        visualize_ml(selected_data)
+        visualize_ml(selected_data, build_encoders(results, ONE_HOT_COLUMNS))
 
 def main_dim_reduce():
     datasets = {'MNIST': mnist_csv}
-    algorithms = {
-        'PCA': pca,
-        'KPCA': kpca,
-        'Isomap': isomap,
-        't-SNE': tsne,
-        'UMAP': umap,
-#       'Autoencoder': ae
-    }
+    algorithms = ['PCA', 'KPCA', 'Isomap', 't-SNE', 'UMAP', 'Autoencoder']
 
     ds_opt = st.sidebar.selectbox('Please select a dataset:', list(datasets.keys()))
     
@@ -416,7 +629,8 @@ def main_dim_reduce():
                 This part will use a separate dataset for you to explore the dimension
                 reduction techniques more comprehensively. 
                 ''')
-    feats, labels, raw = datasets[ds_opt]()
+    with PROFILER.span('dataset loading'):
+        feats, labels, columns = datasets[ds_opt]()
     
     n_samples = st.sidebar.slider('Number of Samples', 
                           min_value=500, 
@@ -424,35 +638,32 @@ def main_dim_reduce():
                           value=min(500, len(feats)), 
                           step=500)
 
-    algo_opt = st.sidebar.selectbox('Please select an algorithm:', list(algorithms.keys()), index=4)
+    algo_opt = st.sidebar.selectbox('Please select an algorithm:', algorithms, index=4)
 
     st.subheader('Raw Data')
-    indices = np.random.choice(len(feats), n_samples, replace=False)
-    raw_data = raw.drop('class', axis='columns').iloc[indices, :]
+    indices = stable_permutation(len(feats))[:n_samples]
+    raw_data = pd.DataFrame(feats.base_array[indices], index=indices, columns=columns)
     raw_data.insert(0, 'class', labels[indices])
     st.write(raw_data)
     
-    results = algorithms[algo_opt](feats, indices)
-
-    
-    reduced = pd.DataFrame(results, columns=['x', 'y', 'z'])
-    reduced['class'] = labels[indices]
-
-    fig = px.scatter_3d(reduced, x='x', y='y', z='z', color='class', opacity=1)
-    fig.update_layout(autosize=False,
-                      width=700,
-                      height=800)
-
-    st.plotly_chart(fig)
+    mode = st.sidebar.radio('Embedding Mode', EMBEDDING_MODES)
+    embed_and_plot(algo_opt, feats, indices, labels[indices], mode)
         
         
 def main():
     st.sidebar.title("Settings")
     dataset = st.sidebar.selectbox('Please select a task:', ['Chart Exploration', 'Dimensionality Reduction'])
-    if dataset == 'Chart Exploration':
-        main_chart()
-    elif dataset == 'Dimensionality Reduction':
-        main_dim_reduce()
+    show_profiling = st.sidebar.checkbox('Show Profiling')
+    PROFILER.start_run(track_allocations=show_profiling or None)
+    try:
+        if dataset == 'Chart Exploration':
+            main_chart()
+        elif dataset == 'Dimensionality Reduction':
+            main_dim_reduce()
+    finally:
+        record = PROFILER.finish_run()
+    if show_profiling:
+        show_profile(record)
 
 
 if __name__ == '__main__':
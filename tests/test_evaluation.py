@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+from sklearn.manifold import trustworthiness
+
+from evaluation import evaluate, neighbourhood_scores
+
+
+def test_matches_sklearn_trustworthiness():
+    # Distances are computed in float32, so agreement is to about 1e-5.
+    rng = np.random.RandomState(0)
+    X = rng.rand(300, 10)
+    Y = X[:, :3] + rng.rand(300, 3) * 0.1
+    scores, _ = neighbourhood_scores(X, Y, k=10)
+    assert scores['trustworthiness'] == pytest.approx(trustworthiness(X, Y, n_neighbors=10), abs=1e-4)
+
+
+def test_continuity_is_trustworthiness_with_the_spaces_swapped():
+    rng = np.random.RandomState(1)
+    X, Y = rng.rand(200, 8), rng.rand(200, 3)
+    forward, _ = neighbourhood_scores(X, Y, k=5)
+    backward, _ = neighbourhood_scores(Y, X, k=5)
+    assert forward['continuity'] == pytest.approx(backward['trustworthiness'])
+
+
+def test_an_isometric_embedding_scores_one():
+    X = np.random.RandomState(2).rand(150, 3)
+    scores = evaluate(X, X * 2 + 1, labels=np.arange(150) % 3, n_queries=50)
+    assert scores['trustworthiness'] == pytest.approx(1.0)
+    assert scores['continuity'] == pytest.approx(1.0)
+    assert 0 <= scores['knn_accuracy'] <= 1
+
+
+def test_too_few_points_give_nan():
+    scores, neighbours = neighbourhood_scores(np.zeros((3, 2)), np.zeros((3, 2)), k=10)
+    assert np.isnan(scores['trustworthiness']) and neighbours is None
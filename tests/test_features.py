@@ -0,0 +1,27 @@
+import numpy as np
+import pandas as pd
+
+from features import CategoryEncoder
+
+
+def test_vocabulary_is_stable_across_fits():
+    encoder = CategoryEncoder().fit(['b', 'a', 'b'])
+    assert encoder.vocabulary == ['a', 'b']
+    encoder.fit(['c', 'a', 'aa'])
+    assert encoder.vocabulary == ['a', 'b', 'aa', 'c']
+    assert list(encoder.codes(['b', 'c', 'a'])) == [1, 3, 0]
+
+
+def test_fixed_vocabulary_keeps_its_order_and_width():
+    encoder = CategoryEncoder(range(1, 13))
+    dense = encoder.transform([12, 1], sparse=False)
+    assert dense.shape == (2, 12)
+    assert dense[0, 11] == 1 and dense[1, 0] == 1
+
+
+def test_unknown_and_missing_values_encode_as_zero_rows():
+    encoder = CategoryEncoder().fit(pd.Series(['x', 'y'], dtype='category'))
+    sparse = encoder.transform(['y', 'z', None])
+    dense = encoder.transform(['y', 'z', None], sparse=False)
+    assert np.array_equal(sparse.toarray(), dense)
+    assert dense.tolist() == [[0, 1], [0, 0], [0, 0]]
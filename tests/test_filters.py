@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+
+from filters import OTHER, FilterIndex
+
+
+def make_index():
+    data = pd.DataFrame({'Primary Type': ['THEFT', 'BATTERY', 'ARSON', 'THEFT', 'HOMICIDE', None],
+                         'Location Description': ['STREET'] * 6,
+                         'Month': [1, 2, 3, 4, 5, 6],
+                         'Hour': [0, 1, 2, 3, 4, 5],
+                         'Year': [2020] * 6})
+    return data, FilterIndex(data)
+
+
+def test_selecting_listed_values():
+    data, index = make_index()
+    mask = index.select('Primary Type', ['THEFT', 'ARSON'], ['THEFT', 'BATTERY', 'ARSON', OTHER])
+    assert list(np.nonzero(mask)[0]) == [0, 2, 3]
+
+
+def test_other_selects_the_complement_of_the_unselected_listed_values():
+    data, index = make_index()
+    mask = index.select('Primary Type', ['THEFT', OTHER], ['THEFT', 'BATTERY', 'ARSON', OTHER])
+    expected = ~data.loc[:, 'Primary Type'].isin(['BATTERY', 'ARSON'])
+    assert np.array_equal(mask, expected.to_numpy())
+
+
+def test_empty_selection_keeps_every_row():
+    data, index = make_index()
+    assert index.select('Primary Type', [], ['THEFT', OTHER]).all()
+
+
+def test_equals_and_counts():
+    data, index = make_index()
+    assert list(np.nonzero(index.equals('Month', 4))[0]) == [3]
+    assert index.top('Primary Type', 1) == ['THEFT']
@@ -0,0 +1,35 @@
+import numpy as np
+import pandas as pd
+
+from sampling import allocate, allocated_prefix, nested_sample, sample_order
+
+
+def test_sample_order_is_a_permutation():
+    order = sample_order(100, seed=3, strata=np.arange(100) % 7)
+    assert sorted(order) == list(range(100))
+
+
+def test_larger_samples_extend_smaller_ones():
+    data = pd.DataFrame({'x': np.arange(500), 'kind': np.where(np.arange(500) % 50 == 0, 'rare', 'common')})
+    for stratify_by in [None, 'kind']:
+        small = nested_sample(data, 40, seed=1, stratify_by=stratify_by)
+        large = nested_sample(data, 200, seed=1, stratify_by=stratify_by)
+        assert list(large.index[:40]) == list(small.index)
+
+
+def test_stratified_samples_keep_rare_strata():
+    strata = np.array(['common'] * 990 + ['rare'] * 10)
+    order = sample_order(len(strata), seed=0, strata=strata)
+    assert 'rare' in set(strata[order[:5]])
+
+
+def test_allocate_is_proportional_and_capped():
+    sizes = allocate([100, 300, 5], 41)
+    assert sizes.sum() == 41
+    assert list(sizes) == [10, 30, 1]
+    assert list(allocate([2, 3], 100)) == [2, 3]
+
+
+def test_allocated_prefix_handles_an_empty_frame():
+    empty = pd.DataFrame({'Year': pd.Series([], dtype=np.int64)})
+    assert allocated_prefix(empty, 10, 'Year').shape[0] == 0
@@ -0,0 +1,33 @@
+import json
+
+from crime_store import read_partition
+from socrata_sync import load_state, state_path, sync_year
+from soda_stub import serve
+
+
+def record(id, updated_on, primary_type='THEFT'):
+    return {'id': str(id), 'case_number': 'JD{:06d}'.format(id), 'date': '2020-03-01T12:00:00.000',
+            'primary_type': primary_type, 'location_description': 'STREET', 'arrest': 'false',
+            'domestic': 'false', 'year': '2020', 'updated_on': updated_on}
+
+
+def test_sync_fetches_only_records_at_or_after_the_high_water_mark(tmp_path):
+    root = str(tmp_path)
+    records = [record(i, '2020-03-{:02d}T00:00:00.000'.format(i)) for i in range(1, 11)]
+    with serve(records) as server:
+        assert sync_year(2020, root=root, base_url=server.base_url, page_size=4) == 10
+        assert len(server.requests) == 3
+        assert load_state(root)['2020'] == '2020-03-10T00:00:00.000'
+
+        server.records.append(record(3, '2020-04-01T00:00:00.000', primary_type='BATTERY'))
+        server.records.append(record(11, '2020-04-02T00:00:00.000'))
+        del server.requests[:]
+        fetched = sync_year(2020, root=root, base_url=server.base_url, page_size=4)
+
+    assert [r['$where'] for r in server.requests] == ["year=2020 AND updated_on >= '2020-03-10T00:00:00.000'"]
+    assert fetched == 3
+    data = read_partition(2020, columns=None, root=root).set_index('ID')
+    assert sorted(data.index) == list(range(1, 12))
+    assert data.loc[3, 'Primary Type'] == 'BATTERY'
+    with open(state_path(root)) as f:
+        assert json.load(f)['2020'] == '2020-04-02T00:00:00.000'